@@ -1,96 +1,115 @@
 #All Analysis Functions (TASK 2)
+#Every report accepts raw data or an EnergySummary from summary.summarize(),
+#so several reports can share a single scan of the data.
+from profiling import profiled
+from reportcache import memoized
+from summary import SEASONS, MONTH_NAMES, summarize
+
+#Daily production percentiles reported with percentiles=True; they come from
+#each group's quantile sketch (see sketch.py), within 1% of the exact value
+PERCENTILES = (5, 50, 95)
 
 "Production Analysis Functions"
 
+@profiled()
+@memoized
 def production_analysis(data):
-    if not data:
+    summary = summarize(data)
+    if not summary.days:
         return None
-
-#Total energy production for each farm
-    total_goldtree = sum(energy.goldtree for energy in data)
-    total_housing = sum(energy.housing for energy in data)
+    overall = summary.overall()
 
 #Total Combined energy production
-    total_production = total_goldtree + total_housing
+    total_production = overall.total.value
 
-#Average daily production between both farms
-    avg_daily = total_production / len(data)
+#Average daily production across every farm
+    avg_daily = total_production / overall.days
 
 #Highest and lowest production days
-    highest_day = max(data, key=lambda x: x.housing + x.goldtree)
-    lowest_day = min(data, key=lambda x: x.housing + x.goldtree)
+    highest_day = overall.max_row
+    lowest_day = overall.min_row
 
-    return {
-        'days_analyzed': len(data),
+    result = {
+        'days_analyzed': overall.days,
         'total_production_kwh': total_production,
-        'total_goldtree_kwh': total_goldtree,
-        'total_housing_kwh': total_housing,
+    }
+#Total energy production for each farm, e.g. total_goldtree_kwh
+    for site, stats in overall.sites.items():
+        result[f'total_{site}_kwh'] = stats.total.value
+    result.update({
         'average_daily_kwh': avg_daily,
         'highest_day_kwh': highest_day,
         'lowest_day_kwh': lowest_day,
-    }
+    })
+    return result
 
 "SEASONAL TREND FUNCTIONS"
 
-#Analyzing production by season, the following
-#Following function is a dictionary of seasons
-
-def seasonal_analysis(data):
-    seasons = {
-        'Winter': [12,1,2],
-        'Spring': [3,4,5],
-        'Summer': [6,7,8],
-        'Autumn': [9,10,11],
-    }
-
-    # This groups the data by the seasons
-    seasonal_data = {season: [] for season in seasons}
+#Analyzing production by season, using the SEASONS dictionary of months
+#With by_site=True each season also gets the same numbers for every farm
+#With percentiles=True each also gets p5/p50/p95 of its daily production
 
-    for energy in data:
-        for season, months in seasons.items():
-            if energy.month in months:
-                seasonal_data[season].append(energy.goldtree + energy.housing)
-                break
+@profiled()
+@memoized
+def seasonal_analysis(data, by_site=False, percentiles=False):
+    summary = summarize(data)
 
     # The following will calculate the average, total, max, min, and days
     #of production per season
     seasonal_stats = {}
-    for season, productions in seasonal_data.items():
-        if productions:
-            seasonal_stats[season] = {
-                'avg_production': sum(productions) / len(productions),
-                'total_production': sum(productions),
-                'max_production': max(productions),
-                'min_production': min(productions),
-                'days': len(productions)
-            }
+    for season in SEASONS:
+        group = summary.season(season)
+        if group:
+            seasonal_stats[season] = _season_stats(group, percentiles)
+            if by_site:
+                seasonal_stats[season]['sites'] = {
+                    site: _season_stats(stats, percentiles) for site, stats in group.sites.items()}
         else:
             seasonal_stats[season] = None
 #returns the above:)
     return seasonal_stats
 
+def _season_stats(stats, percentiles=False):
+    result = {
+        'avg_production': stats.total.value / stats.days,
+        'total_production': stats.total.value,
+        'max_production': stats.max,
+        'min_production': stats.min,
+        'days': stats.days
+    }
+    if percentiles:
+        result.update(_percentiles(stats, '_production'))
+    return result
+
 #The following is the monthly analysis of solar production
-def monthly_analysis(data):
-    monthly_data = {}
-    for energy in data:
-        key = (energy.year, energy.month)
-        if key not in monthly_data:
-            monthly_data[key] = []
-        monthly_data[key].append(energy.goldtree + energy.housing)
-#dictionary of each month
-    monthly_stats = {}
-    monthly_names = ['January', 'February', 'March', 'April', 'May','June',
-                     'July', 'August', 'September','October', 'November', 'December'] #
+@profiled()
+@memoized
+def monthly_analysis(data, by_site=False, percentiles=False):
+    summary = summarize(data)
+
 #Calculates the total, avg, max, min, and days recorded for each month's production
-    for (year, month), productions in sorted(monthly_data.items()):
-        month_label = f"{year}-{monthly_names[month - 1]}"
-        monthly_stats[month_label] = {
-            'total_production': sum(productions),
-            'avg_daily_production': sum(productions) / len(productions),
-            'days_recorded': len(productions),
-            'max_day': max(productions),
-            'min_day': min(productions)
-        }
-
-        return monthly_stats
+    monthly_stats = {}
+    for (year, month), group in sorted(summary.months.items()):
+        month_label = f"{year}-{MONTH_NAMES[month - 1]}"
+        monthly_stats[month_label] = _month_stats(group, percentiles)
+        if by_site:
+            monthly_stats[month_label]['sites'] = {
+                site: _month_stats(stats, percentiles) for site, stats in group.sites.items()}
+
+    return monthly_stats
+
+def _month_stats(stats, percentiles=False):
+    result = {
+        'total_production': stats.total.value,
+        'avg_daily_production': stats.total.value / stats.days,
+        'days_recorded': stats.days,
+        'max_day': stats.max,
+        'min_day': stats.min
+    }
+    if percentiles:
+        result.update(_percentiles(stats, '_day'))
+    return result
 
+#e.g. {'p5_day': ..., 'p50_day': ..., 'p95_day': ...}
+def _percentiles(stats, suffix):
+    return {f'p{p}{suffix}': stats.sketch.quantile(p / 100) for p in PERCENTILES}
@@ -1,63 +1,95 @@
+#Cost functions accept raw data or an EnergySummary (see summary.py)
+#monthly_savings_breakdown and pge_comparison also take a time-of-use tariff
+#(see tariff.py) in place of the flat rate; comprehensive_cost_analysis hands
+#its tariff to both
+import random
+from array import array
+from itertools import repeat
+from math import fsum
+from operator import add, mul, sub
+
+from profiling import profiled
+from reportcache import memoized
+from sketch import QuantileSketch
+from summary import MONTH_NAMES, summarize
 
 # Constants for California electricity rates
 CA_AVG_RATE = 0.30  # $0.30 per kWh (California average)
 PGE_SLO_RATE = 0.32  # Adjust based on actual PGE rate for SLO
 DAYS = 365
+DAYS_IN_MONTH = [31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31]
 
 
-def total_cost_savings(data, rate_per_kwh=CA_AVG_RATE):
+@profiled()
+@memoized
+def total_cost_savings(data, rate_per_kwh=CA_AVG_RATE, by_site=False):
+    overall = summarize(data).overall()
 
-
-    total_kwh = sum(energy.goldtree + energy.housing for energy in data)
+    total_kwh = overall.total.value
     total_savings = total_kwh * rate_per_kwh
-    days_analyzed = len(data)
+    days_analyzed = overall.days
 
-    return {
+    result = {
         'total_kwh_produced': total_kwh,
         'total_savings': total_savings,
         'days_analyzed': days_analyzed,
         'rate_used': rate_per_kwh
     }
+    # Optional split of the savings between the farms
+    if by_site:
+        result['sites'] = {site: _site_savings(stats, rate_per_kwh)
+                           for site, stats in overall.sites.items()}
+    return result
 
 
-def monthly_savings_breakdown(data, rate_per_kwh=CA_AVG_RATE):
+def _site_savings(stats, rate_per_kwh):
+    return {
+        'total_kwh': stats.total.value,
+        'total_savings': stats.total.value * rate_per_kwh,
+        'days_recorded': stats.days
+    }
 
-    monthly_data = {}
-    month_names = ['January', 'February', 'March', 'April', 'May', 'June',
-                   'July', 'August', 'September', 'October', 'November', 'December']
 
-    # Group data by month
-    for energy in data:
-        key = (energy.year, energy.month)
-        if key not in monthly_data:
-            monthly_data[key] = {
-                'total_kwh': 0,
-                'days': 0
-            }
-        monthly_data[key]['total_kwh'] += (energy.goldtree + energy.housing)
-        monthly_data[key]['days'] += 1
+@profiled()
+@memoized
+def monthly_savings_breakdown(data, rate_per_kwh=CA_AVG_RATE, by_site=False, tariff=None):
+    # Monthly totals come grouped already from the summary
+    monthly_data = summarize(data).months
 
     # Calculate savings for each month
     monthly_savings = {}
-    for (year, month), data_dict in sorted(monthly_data.items()):
-        month_label = f"{year}-{month_names[month - 1]}"
-        total_kwh = data_dict['total_kwh']
+    for (year, month), group in sorted(monthly_data.items()):
+        month_label = f"{year}-{MONTH_NAMES[month - 1]}"
+        total_kwh = group.total.value
+        # With a TOU tariff each hour of the month is priced at its own rate
+        if tariff is not None:
+            rate_per_kwh = tariff.group_cost(month, group) / total_kwh
         savings = total_kwh * rate_per_kwh
 
         monthly_savings[month_label] = {
             'total_kwh': total_kwh,
             'total_savings': savings,
-            'days_recorded': data_dict['days'],
-            'avg_daily_kwh': total_kwh / data_dict['days'],
-            'avg_daily_savings': savings / data_dict['days']
+            'days_recorded': group.days,
+            'avg_daily_kwh': total_kwh / group.days,
+            'avg_daily_savings': savings / group.days
         }
+        if tariff is not None:
+            monthly_savings[month_label]['effective_rate'] = rate_per_kwh
+        if by_site:
+            monthly_savings[month_label]['sites'] = {
+                site: _site_savings(stats, rate_per_kwh if tariff is None
+                                    else tariff.group_cost(month, stats) / stats.total.value)
+                for site, stats in group.sites.items()}
 
     return monthly_savings
 
 
+@profiled()
+@memoized
 def yearly_savings_projection(data, rate_per_kwh=CA_AVG_RATE):
-    total_kwh = sum(energy.goldtree + energy.housing for energy in data)
-    days_analyzed = len(data)
+    overall = summarize(data).overall()
+    total_kwh = overall.total.value
+    days_analyzed = overall.days
 
     # Calculate daily average
     avg_daily_kwh = total_kwh / days_analyzed
@@ -67,12 +99,6 @@ def yearly_savings_projection(data, rate_per_kwh=CA_AVG_RATE):
     projected_annual_kwh = avg_daily_kwh * DAYS
     projected_annual_savings = projected_annual_kwh * rate_per_kwh
 
-    # Calculate based on 500 days of data
-
-    months_in_data = days_analyzed / 30.44  # Average days per month
-    projected_12_month_kwh = (total_kwh / days_analyzed) * DAYS
-    projected_12_month_savings = projected_12_month_kwh * rate_per_kwh
-
     return {
         'days_analyzed': days_analyzed,
         'avg_daily_kwh': avg_daily_kwh,
@@ -83,10 +109,18 @@ def yearly_savings_projection(data, rate_per_kwh=CA_AVG_RATE):
     }
 
 
-def pge_comparison(data, solar_rate=CA_AVG_RATE, pge_rate=PGE_SLO_RATE):
+@profiled()
+@memoized
+def pge_comparison(data, solar_rate=CA_AVG_RATE, pge_rate=PGE_SLO_RATE, tariff=None):
+    summary = summarize(data)
+    overall = summary.overall()
 
-    total_kwh = sum(energy.goldtree + energy.housing for energy in data)
-    days_analyzed = len(data)
+    total_kwh = overall.total.value
+    days_analyzed = overall.days
+
+    # A TOU tariff replaces the flat PG&E rate with its average over the energy
+    if tariff is not None:
+        pge_rate = tariff.cost(summary) / total_kwh
 
     # What Cal Poly saved with solar
     solar_savings = total_kwh * solar_rate
@@ -105,7 +139,7 @@ def pge_comparison(data, solar_rate=CA_AVG_RATE, pge_rate=PGE_SLO_RATE):
     annual_pge_cost = annual_kwh * pge_rate
     annual_savings_vs_pge = annual_pge_cost - annual_solar_value
 
-    return {
+    result = {
         'total_kwh_produced': total_kwh,
         'days_analyzed': days_analyzed,
 
@@ -127,14 +161,149 @@ def pge_comparison(data, solar_rate=CA_AVG_RATE, pge_rate=PGE_SLO_RATE):
         # Percentage savings
         'percent_saved_vs_pge': (annual_savings_vs_pge / annual_pge_cost * 100) if annual_pge_cost > 0 else 0
     }
+    if tariff is not None:
+        result['pge_tariff'] = tariff.name
+    return result
 
 
-def comprehensive_cost_analysis(data, ca_rate=CA_AVG_RATE, pge_rate=PGE_SLO_RATE):
+@profiled()
+@memoized
+def comprehensive_cost_analysis(data, ca_rate=CA_AVG_RATE, pge_rate=PGE_SLO_RATE, by_site=False, tariff=None):
+    # One scan of the data shared by all four reports
+    summary = summarize(data)
 
     return {
-        'total_savings': total_cost_savings(data, ca_rate),
-        'monthly_breakdown': monthly_savings_breakdown(data, ca_rate),
-        'yearly_projection': yearly_savings_projection(data, ca_rate),
-        'pge_comparison': pge_comparison(data, ca_rate, pge_rate)
+        'total_savings': total_cost_savings(summary, ca_rate, by_site),
+        'monthly_breakdown': monthly_savings_breakdown(summary, ca_rate, by_site, tariff),
+        'yearly_projection': yearly_savings_projection(summary, ca_rate),
+        'pge_comparison': pge_comparison(summary, ca_rate, pge_rate, tariff)
     }
 
+
+
+
+"RATE SCENARIO SWEEPS"
+
+#Finance asks for thousands of tariff combinations at once. rate_scenarios runs
+#them all off one summary: the kWh totals are read once and every scenario is
+#a column of rates multiplied through with map() over typed arrays.
+#ca_rates, pge_rates and escalation can each be a list of values or a single
+#value used for every scenario; escalation is the yearly rise in both rates.
+
+@profiled()
+@memoized
+def rate_scenarios(data, ca_rates, pge_rates=PGE_SLO_RATE, escalation=0.0, years=1):
+    summary = summarize(data)
+    overall = summary.overall()
+    sizes = {len(values) for values in (ca_rates, pge_rates, escalation)
+             if not isinstance(values, (int, float))}
+    if len(sizes) > 1:
+        raise ValueError('ca_rates, pge_rates and escalation must have the same length')
+    n = sizes.pop() if sizes else 1
+    ca = _rate_array(ca_rates, n)
+    pge = _rate_array(pge_rates, n)
+    growth = _rate_array(escalation, n)
+
+    total_kwh = overall.total.value
+    annual_kwh = total_kwh / overall.days * DAYS if overall.days else 0.0
+
+    # Sum of (1 + escalation) ** year over the projection, per scenario
+    years_factor = array('d', (sum((1 + rise) ** year for year in range(years)) for rise in growth))
+    annual_savings = _scale(ca, annual_kwh)
+    annual_pge_cost = _scale(pge, annual_kwh)
+    annual_vs_pge = array('d', map(sub, annual_pge_cost, annual_savings))
+
+    monthly = {}
+    for (year, month), group in sorted(summary.months.items()):
+        monthly[f"{year}-{MONTH_NAMES[month - 1]}"] = _scale(ca, group.total.value)
+
+    return {
+        'scenarios': n,
+        'ca_rate': ca,
+        'pge_rate': pge,
+        'escalation': growth,
+        'total_kwh_produced': total_kwh,
+        'projected_annual_kwh': annual_kwh,
+        'total_savings': _scale(ca, total_kwh),
+        'pge_cost_equivalent': _scale(pge, total_kwh),
+        'projected_annual_savings': annual_savings,
+        'projected_annual_savings_vs_pge': annual_vs_pge,
+        'percent_saved_vs_pge': array('d', (vs * 100 / cost if cost > 0 else 0.0
+                                            for vs, cost in zip(annual_vs_pge, annual_pge_cost))),
+        'multi_year_savings': array('d', map(mul, annual_savings, years_factor)),
+        'multi_year_savings_vs_pge': array('d', map(mul, annual_vs_pge, years_factor)),
+        'monthly_savings': monthly,
+    }
+
+
+def _rate_array(values, n):
+    if isinstance(values, (int, float)):
+        return array('d', repeat(float(values), n))
+    return array('d', values)
+
+
+def _scale(rates, kwh):
+    return array('d', map(mul, rates, repeat(kwh, len(rates))))
+
+
+"MONTE CARLO PROJECTION"
+
+#yearly_savings_projection scales the average day by 365, which ignores that a
+#summer day produces about twice a winter one. simulated_projection builds each
+#simulated year month by month instead, drawing every day at random from the
+#daily totals seen in that calendar month (as held by the summary's quantile
+#sketches), and reports bands over thousands of simulated years. One month of
+#every simulated year is drawn in a single random.choices() call.
+
+@profiled()
+@memoized
+def simulated_projection(data, rate_per_kwh=CA_AVG_RATE, pge_rate=PGE_SLO_RATE,
+                         simulations=10_000, seed=0, confidence=0.90):
+    summary = summarize(data)
+    rng = random.Random(seed)
+
+    days_by_month = {}
+    for (year, month), group in summary.months.items():
+        days_by_month.setdefault(month, QuantileSketch()).merge(group.sketch)
+    missing = [MONTH_NAMES[month - 1] for month in range(1, 13) if month not in days_by_month]
+    if missing:
+        raise ValueError(f"no data to simulate {', '.join(missing)}")
+
+    annual_kwh = array('d', bytes(8 * simulations))
+    monthly_kwh = {}
+    for month, days in enumerate(DAYS_IN_MONTH, 1):
+        draws = iter(rng.choices(days_by_month[month].values(), k=days * simulations))
+        # Consecutive runs of `days` draws make up one simulated month
+        month_kwh = array('d', map(fsum, zip(*[draws] * days)))
+        monthly_kwh[MONTH_NAMES[month - 1]] = fsum(month_kwh) / simulations
+        annual_kwh = array('d', map(add, annual_kwh, month_kwh))
+
+    kwh_band = _band(annual_kwh, confidence)
+    return {
+        'simulations': simulations,
+        'seed': seed,
+        'confidence': confidence,
+        'rate_used': rate_per_kwh,
+        'pge_rate': pge_rate,
+        'annual_kwh': kwh_band,
+        'annual_savings': _scale_band(kwh_band, rate_per_kwh),
+        'annual_pge_cost': _scale_band(kwh_band, pge_rate),
+        'annual_savings_vs_pge': _scale_band(kwh_band, pge_rate - rate_per_kwh),
+        'monthly_kwh': monthly_kwh,
+    }
+
+
+def _band(values, confidence):
+    ordered = sorted(values)
+    last = len(ordered) - 1
+    tail = (1 - confidence) / 2
+    return {
+        'mean': fsum(ordered) / len(ordered),
+        'low': ordered[round(tail * last)],
+        'median': ordered[last // 2],
+        'high': ordered[round((1 - tail) * last)],
+    }
+
+
+def _scale_band(band, rate):
+    return {key: value * rate for key, value in band.items()}
@@ -0,0 +1,184 @@
+#Rolling statistics and meter glitch detection. Every site keeps a sliding
+#window of its recent daily readings with a running mean and variance, updated
+#in O(1) as a day enters and the oldest leaves, so a pass over the data is O(n)
+#with memory fixed by the window size whether the rows come from a table or a
+#stream of batches. Both rolling() and screen() hand back results a batch at a
+#time.
+#
+#    anomalies = Anomalies()
+#    clean = screen(get_data(), anomalies, exclude=True)
+#    production_analysis(clean)
+#
+#A reading is an anomaly when its log is more than `threshold` standard
+#deviations from the mean log of the site's previous `window` days. Working in
+#logs judges spikes and dropouts by ratio (a 100x spike and a 1/100 dropout are
+#equally far out), and min_std keeps a run of steady sunny days from making an
+#ordinary cloudy one look like a glitch. Anomalies never enter the window, so
+#one glitch does not widen the band used to judge the days after it.
+from array import array
+from collections import deque
+from datetime import date
+from math import exp, log, sqrt
+
+from builddata import DAY, EnergyTable, iter_batches
+
+WINDOWS = (7, 30)
+
+
+class RollingStats:
+    #Mean and standard deviation of the last `size` values pushed, or, when
+    #each push gives its day (a date ordinal), of the values from the last
+    #`size` days. Keeps the sum and sum of squares of the values in the window,
+    #so a push is O(1) amortized: add the new value, subtract those leaving.
+    #Values are taken relative to the first one seen and the sums carry their
+    #rounding error (Neumaier), so a huge glitch passing through the window
+    #leaves no residue behind.
+
+    def __init__(self, size):
+        self.size = size
+        self.values = deque()
+        self.days = deque()
+        self.shift = None
+        self.sum = [0.0, 0.0]
+        self.squares = [0.0, 0.0]
+
+    def __len__(self):
+        return len(self.values)
+
+    def _drop(self):
+        old = self.values.popleft() - self.shift
+        _add(self.sum, -old)
+        _add(self.squares, -old * old)
+
+    def push(self, value, day=None):
+        if self.shift is None:
+            self.shift = value
+        if day is None:
+            if len(self.values) == self.size:
+                self._drop()
+        else:
+            while self.days and self.days[0] <= day - self.size:
+                self.days.popleft()
+                self._drop()
+            self.days.append(day)
+        self.values.append(value)
+        value -= self.shift
+        _add(self.sum, value)
+        _add(self.squares, value * value)
+
+    @property
+    def mean(self):
+        n = len(self.values)
+        return self.shift + (self.sum[0] + self.sum[1]) / n if n else 0.0
+
+    @property
+    def std(self):
+        #Sample standard deviation; 0 until there are two values
+        n = len(self.values)
+        if n < 2:
+            return 0.0
+        total = self.sum[0] + self.sum[1]
+        squares = self.squares[0] + self.squares[1]
+        return sqrt(max(squares - total * total / n, 0.0) / (n - 1))
+
+
+def _add(total, value):
+    #total is [sum, rounding error so far]
+    result = total[0] + value
+    if abs(total[0]) >= abs(value):
+        total[1] += (total[0] - result) + value
+    else:
+        total[1] += (value - result) + total[0]
+    total[0] = result
+
+
+def rolling(data, windows=WINDOWS):
+    #Yields the trailing rolling means and standard deviations of every site
+    #for each batch of daily rows: {'dates': [(year, month, day), ...], site:
+    #{window: {'mean': array, 'std': array}}}, one value per row of the batch.
+    #A row's window is the days from window - 1 days before it to its own, so
+    #a gap in the export leaves fewer readings in the window rather than
+    #stretching it. Interval exports are refused; resample them to days first
+    #(see resample.py).
+    trackers = {}
+    for table in iter_batches(data):
+        if table.interval < DAY:
+            raise ValueError('rolling() takes daily rows; resample interval exports to days first')
+        dates = list(map(table.date_of, range(len(table))))
+        days = [date(*day).toordinal() for day in dates]
+        result = {'dates': dates}
+        for site, column in table.readings.items():
+            if site not in trackers:
+                trackers[site] = [RollingStats(size) for size in windows]
+            result[site] = {}
+            for stats in trackers[site]:
+                means = array('d')
+                stds = array('d')
+                for value, day in zip(column, days):
+                    stats.push(value, day)
+                    means.append(stats.mean)
+                    stds.append(stats.std)
+                result[site][stats.size] = {'mean': means, 'std': stds}
+        yield result
+
+
+class Anomalies:
+    #Readings screen() judged to be glitches, as (date, site, value, expected)
+    #where expected is the window's typical (geometric mean) reading; counted
+    #per site, with the first `keep` kept
+
+    def __init__(self, keep=1000):
+        self.keep = keep
+        self.counts = {}
+        self.rows = []
+
+    def add(self, day, site, value, expected):
+        self.counts[site] = self.counts.get(site, 0) + 1
+        if len(self.rows) < self.keep:
+            self.rows.append((day, site, value, expected))
+
+    def __len__(self):
+        return sum(self.counts.values())
+
+    def __repr__(self):
+        return f'Anomalies({len(self)} readings, {self.counts})'
+
+
+def screen(data, anomalies=None, window=30, threshold=5.0, min_std=0.35, min_days=7, exclude=False):
+    #Yields the data back as EnergyTable batches after checking every reading
+    #against its site's trailing window. Anomalies are recorded in `anomalies`
+    #when one is given; with exclude=True the days they happen on are also
+    #dropped, so every report built from the result leaves them out. Nothing is
+    #judged until a site has min_days of history.
+    #Rows are checked at their own interval, so resample interval exports to
+    #days first (see resample.py).
+    trackers = {}
+    for table in iter_batches(data):
+        keep = array('b', [1]) * len(table)
+        for site, column in table.readings.items():
+            stats = trackers.get(site)
+            if stats is None:
+                stats = trackers[site] = RollingStats(window)
+            for row, value in enumerate(column):
+                scaled = log(value) if value > 0 else None
+                if len(stats) >= min_days and (
+                        scaled is None or abs(scaled - stats.mean) > threshold * max(stats.std, min_std)):
+                    keep[row] = 0
+                    if anomalies is not None:
+                        anomalies.add(table.date_of(row), site, value, exp(stats.mean))
+                elif scaled is not None:
+                    stats.push(scaled)
+        if exclude and not all(keep):
+            table = table.take(row for row, kept in enumerate(keep) if kept)
+        if len(table):
+            yield table
+
+
+def clean(data, **options):
+    #The rows of data with anomalous days removed, as one EnergyTable
+    result = None
+    for table in screen(data, exclude=True, **options):
+        if result is None:
+            result = EnergyTable(table.sites, table.interval)
+        result.extend(table)
+    return result if result is not None else EnergyTable()
@@ -0,0 +1,251 @@
+#Benchmarks for loading and reporting, on synthetic exports of any size.
+#
+#    python benchmark.py --rows 1000 100000 1000000 --output bench.json
+#    python benchmark.py --rows 1000000 --resolution 15min --sites 12 --bad-rows 0.001
+#    python benchmark.py --compare before.json after.json
+#
+#generate_csv writes an export in the Cal Poly column format (display column
+#per meter, then the raw numbers) from a seeded RNG, so the same arguments
+#always give the same file. run_benchmark times ingestion and every report on
+#it, taking the best of `repeat` runs, then runs each stage once more under
+#tracemalloc for its peak memory. Results are saved as JSON with the commit
+#they were measured on.
+import argparse
+import json
+import math
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import date, datetime, timedelta
+
+RESOLUTIONS = {'day': 86400, 'hour': 3600, '15min': 900}
+SITE_NAMES = ['Cal Poly Gold Tree Solar (C) Total Meter Energy',
+              'Cal Poly Student Housing Solar Total Meter Energy']
+#Typical peak day output of each generated site, kWh
+SITE_SIZES = [38000.0, 2900.0]
+#The rate sweep timed by the rate_scenarios stage
+SWEEP_RATES = [0.20 + i * 0.00002 for i in range(10_000)]
+BAD_ROWS = [
+    lambda line: '\n',                                             # blank line
+    lambda line: line.rsplit(',', 1)[0] + '\n',                    # wrong column count
+    lambda line: 'not a date' + line[line.index(','):],            # bad timestamp
+    lambda line: line[:line.rindex(',')] + ',0\n',                 # zero reading
+    lambda line: line[:line.rindex(',')] + ',n/a\n',               # unreadable reading
+]
+
+
+def site_names(sites):
+    return (SITE_NAMES + [f'Site {n} Total Meter Energy' for n in range(len(SITE_NAMES) + 1, sites + 1)])[:sites]
+
+
+def is_daylight_time(day):
+    #US rules: from the second Sunday of March to the first Sunday of November
+    march = date(day.year, 3, 8)
+    november = date(day.year, 11, 1)
+    start = march + timedelta(days=(6 - march.weekday()) % 7)
+    end = november + timedelta(days=(6 - november.weekday()) % 7)
+    return start <= day < end
+
+
+def generate_csv(path, rows, sites=2, resolution='day', bad_rows=0.0, seed=0, start=date(2024, 7, 1)):
+    #Writes `rows` readings (plus bad_rows * rows injected bad lines) to path
+    #and returns the number of bad lines written
+    step = RESOLUTIONS[resolution]
+    per_day = 86400 // step
+    if start.toordinal() + rows // per_day > date(9999, 12, 31).toordinal():
+        raise ValueError(f'{rows} rows at one per {resolution} runs past the year 9999')
+    rng = random.Random(seed)
+    sizes = [SITE_SIZES[n] if n < len(SITE_SIZES) else rng.uniform(500.0, 50000.0) for n in range(sites)]
+    #Share of a day's output in each interval: a daylight bell from 6am to 6pm,
+    #with a trickle overnight since the parser rejects zero readings
+    shape = []
+    for n in range(per_day):
+        hour = (n + 0.5) * 24 / per_day
+        shape.append(max(math.sin(math.pi * (hour - 6) / 12), 0.0) + 0.002 if per_day > 1 else 1.0)
+    total = sum(shape)
+    shape = [share / total for share in shape]
+    bad = 0
+    with open(path, 'w', newline='') as f:
+        f.write('Timestamp,' + ','.join(site_names(sites)) + ',' * sites + '\n')
+        moment = datetime(start.year, start.month, start.day)
+        day = None
+        lines = []
+        for row in range(rows):
+            if moment.date() != day:
+                day = moment.date()
+                zone = 'PDT' if is_daylight_time(day) else 'PST'
+                season = 0.75 + 0.25 * math.cos(2 * math.pi * (day.timetuple().tm_yday - 172) / 365)
+                weather = min(1.0, rng.betavariate(5, 1) * 1.05)
+                daily = [size * season * weather for size in sizes]
+            share = shape[row % per_day]
+            values = [value * share * rng.uniform(0.97, 1.03) for value in daily]
+            line = '{:%Y-%m-%d %H:%M:%S} {},{},{}\n'.format(
+                moment, zone, ','.join(f'{value:.1f}kWh' for value in values),
+                ','.join(f'{value:.3f}' for value in values))
+            if bad_rows and rng.random() < bad_rows:
+                lines.append(rng.choice(BAD_ROWS)(line))
+                bad += 1
+            lines.append(line)
+            moment += timedelta(seconds=step)
+            if len(lines) >= 10000:
+                f.writelines(lines)
+                lines.clear()
+        f.writelines(lines)
+    return bad
+
+
+def data_file(folder, rows, sites, resolution, bad_rows, seed):
+    #Generated files are kept and reused between runs with the same arguments
+    name = f'bench-{rows}-{sites}-{resolution}-{bad_rows}-{seed}.csv'
+    path = os.path.join(folder, name)
+    if not os.path.exists(path):
+        generate_csv(path + '.tmp', rows, sites, resolution, bad_rows, seed)
+        os.replace(path + '.tmp', path)
+    return path
+
+
+def stages(path):
+    #(name, function) for every stage measured; each call starts from the
+    #file or a fresh copy of the table, so no stage gets another's cached work.
+    #A stage the export can't run (function None) is recorded as skipped.
+    import Analysis
+    from builddata import BATCH_SIZE, Quarantine, get_data, iter_data
+    from CostSavings import comprehensive_cost_analysis, rate_scenarios, simulated_projection
+    from summary import EnergySummary
+    table = get_data(path, cache=False, quarantine=Quarantine())
+    get_data(path)
+    #The projection draws days from every calendar month
+    every_month = len({month for year, month in table.summary.months}) == 12
+    return [
+        ('get_data', lambda: get_data(path, cache=False, quarantine=Quarantine())),
+        ('get_data_cached', lambda: get_data(path)),
+        ('stream_summary', lambda: EnergySummary().update(iter_data(path, BATCH_SIZE))),
+        ('summary', lambda: table[:].summary),
+        ('production_analysis', lambda: Analysis.production_analysis(table[:])),
+        ('seasonal_analysis', lambda: Analysis.seasonal_analysis(table[:])),
+        ('monthly_analysis', lambda: Analysis.monthly_analysis(table[:])),
+        ('comprehensive_cost_analysis', lambda: comprehensive_cost_analysis(table[:])),
+        ('rate_scenarios', lambda: rate_scenarios(table[:], SWEEP_RATES, 0.32, escalation=0.03, years=10)),
+        ('simulated_projection', (lambda: simulated_projection(table[:], simulations=10_000, seed=42))
+         if every_month else None),
+    ]
+
+
+def measure(function, repeat=3, memory=True):
+    best = math.inf
+    for run in range(repeat):
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+    result = {'seconds': best}
+    if memory:
+        tracemalloc.start()
+        try:
+            function()
+            result['peak_bytes'] = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    return result
+
+
+def run_benchmark(rows, sites=2, resolution='day', bad_rows=0.0, seed=0, repeat=3, memory=True, folder=None):
+    from reportcache import CACHE
+    folder = folder or os.path.join(tempfile.gettempdir(), 'energy-bench')
+    os.makedirs(folder, exist_ok=True)
+    start = time.perf_counter()
+    path = data_file(folder, rows, sites, resolution, bad_rows, seed)
+    results = {'generate': {'seconds': time.perf_counter() - start}}
+    #Reports are timed doing their work, not answering from the report cache
+    maxsize, CACHE.maxsize = CACHE.maxsize, 0
+    try:
+        for name, function in stages(path):
+            if function is None:
+                results[name] = {'seconds': None, 'skipped': True}
+                continue
+            results[name] = measure(function, repeat, memory)
+            results[name]['rows_per_second'] = rows / results[name]['seconds'] if results[name]['seconds'] else None
+    finally:
+        CACHE.maxsize = maxsize
+    return {
+        'rows': rows,
+        'sites': sites,
+        'resolution': resolution,
+        'bad_rows': bad_rows,
+        'seed': seed,
+        'file_bytes': os.path.getsize(path),
+        'stages': results,
+    }
+
+
+def environment():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        'commit': commit,
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'when': datetime.now().isoformat(timespec='seconds'),
+    }
+
+
+def compare(before, after):
+    #Lines of 'rows stage before after ratio' for every stage in both files
+    lines = []
+    old = {(run['rows'], run['resolution'], run['sites']): run for run in before['runs']}
+    for run in after['runs']:
+        match = old.get((run['rows'], run['resolution'], run['sites']))
+        if match is None:
+            continue
+        for stage, result in run['stages'].items():
+            was, now = match['stages'].get(stage, {}).get('seconds'), result['seconds']
+            if was is not None and now is not None:
+                lines.append(f"{run['rows']:>10} {stage:<28} {was:10.4f}s {now:10.4f}s {now / was if was else math.inf:6.2f}x")
+    return lines
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Time loading and reports on synthetic exports')
+    parser.add_argument('--rows', type=int, nargs='+', default=[1000, 100000])
+    parser.add_argument('--sites', type=int, default=2)
+    parser.add_argument('--resolution', choices=RESOLUTIONS, default='day')
+    parser.add_argument('--bad-rows', type=float, default=0.0, help='share of extra bad lines to inject')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--no-memory', action='store_true', help='skip the tracemalloc runs')
+    parser.add_argument('--folder', help='where generated files are kept')
+    parser.add_argument('--output', help='JSON file for the results')
+    parser.add_argument('--compare', nargs=2, metavar=('BEFORE', 'AFTER'))
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        with open(args.compare[0]) as f, open(args.compare[1]) as g:
+            print('\n'.join(compare(json.load(f), json.load(g))))
+        return
+
+    report = {'environment': environment(), 'runs': []}
+    for rows in args.rows:
+        run = run_benchmark(rows, args.sites, args.resolution, args.bad_rows, args.seed,
+                            args.repeat, not args.no_memory, args.folder)
+        report['runs'].append(run)
+        for stage, result in run['stages'].items():
+            if result['seconds'] is None:
+                print(f"{rows:>10} {stage:<28} {'skipped':>11}")
+                continue
+            peak = result.get('peak_bytes')
+            print(f"{rows:>10} {stage:<28} {result['seconds']:10.4f}s"
+                  + (f' {peak / 2**20:10.1f} MiB' if peak is not None else ''))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
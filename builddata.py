@@ -1,3 +1,39 @@
+import csv
+import os
+import re
+from array import array
+from bisect import bisect_left, bisect_right
+from datetime import date
+from functools import reduce
+from itertools import chain, compress, islice, repeat
+from math import gcd, isfinite
+from operator import add, itemgetter, le, mul, ne, sub
+
+from profiling import profiled
+
+DATA_FILE = 'Solar data cal poly csv.csv'
+BATCH_SIZE = 4096
+BLOCK_SIZE = 1 << 18
+DAY = 86400
+HOUR = 3600
+MINUTE = 60
+EPOCH = date(1970, 1, 1).toordinal()
+
+#Short names for the meters in the Cal Poly export; any other meter column is
+#named from its header (see site_key)
+SITE_KEYS = {
+    'Cal Poly Gold Tree Solar (C) Total Meter Energy': 'goldtree',
+    'Cal Poly Student Housing Solar Total Meter Energy': 'housing',
+}
+DEFAULT_SITES = ('goldtree', 'housing')
+
+SEASONS = {
+    'Winter': [12,1,2],
+    'Spring': [3,4,5],
+    'Summer': [6,7,8],
+    'Autumn': [9,10,11],
+}
+
 
 def str_to_float(s:str):
     try:
@@ -8,40 +44,701 @@ def str_to_float(s:str):
 
 
 class Energy:
-    def __init__(self, year, month, day, goldtree, housing):
+    #One day of readings, or for interval exports one reading starting at
+    #hour:minute local time, utc_offset minutes east of UTC (-420 for PDT).
+    #goldtree and housing stay positional for the Cal Poly export; other meters
+    #are passed by keyword and read back as attributes.
+    __slots__ = ('year', 'month', 'day', 'hour', 'minute', 'utc_offset', 'readings')
+
+    def __init__(self, year, month, day, goldtree=None, housing=None, **sites):
         self.year = year
         self.month = month
         self.day = day
-        self.goldtree = goldtree
-        self.housing = housing
+        self.hour = 0
+        self.minute = 0
+        self.utc_offset = 0
+        self.readings = {}
+        if goldtree is not None:
+            self.readings['goldtree'] = goldtree
+        if housing is not None:
+            self.readings['housing'] = housing
+        self.readings.update(sites)
+
+    @classmethod
+    def from_readings(cls, year, month, day, readings, hour=0, minute=0, utc_offset=0):
+        energy = cls.__new__(cls)
+        energy.year = year
+        energy.month = month
+        energy.day = day
+        energy.hour = hour
+        energy.minute = minute
+        energy.utc_offset = utc_offset
+        energy.readings = readings
+        return energy
+
+    def __getattr__(self, name):
+        if name == 'readings' or name.startswith('__'):
+            raise AttributeError(name)
+        try:
+            return self.readings[name]
+        except KeyError:
+            raise AttributeError(name) from None
+
+    @property
+    def total(self):
+        return sum(self.readings.values())
+
     def __repr__(self):
-        return 'Energy Data({}, {}, {}, {}, {})'.format(
-        self.year,
-        self.month,
-        self.day,
-        self.goldtree,
-        self.housing)
+        values = [self.year, self.month, self.day]
+        for site, reading in self.readings.items():
+            values.append(reading if site in DEFAULT_SITES else f'{site}={reading}')
+        if self.hour or self.minute:
+            values.append(f'time={self.hour:02d}:{self.minute:02d}')
+        return 'Energy Data({})'.format(', '.join(map(str, values)))
     def __eq__(self, other):
-        return self.year == other.year and self.month == other.month and self.day == other.day and self.goldtree == other.goldtree and self.housing == other.housing and type(self) == type(other)
-
-
-def get_data():
-    with open('Solar data cal poly csv.csv') as f:
-        data = []
-        for line in f:
-            linesplit = line.split(",")
-            date = linesplit[0].split(" ")
-            datesplit = date[0].split("-")
-            if len(datesplit) == 3:
-                year1 = int(datesplit[0])
-                month1 = int(datesplit[1])
-                day1 = int(datesplit[2])
-            if len(linesplit) == 5:
-                goldtree1 = str_to_float(linesplit[3])
-                housing1 = str_to_float(linesplit[4])
-            if len(linesplit) == 5 and len(datesplit) == 3 and not goldtree1 ==0 and not housing1 ==0:
-                en = Energy(year1, month1, day1, goldtree1, housing1)
-                data.append(en)
+        return self.year == other.year and self.month == other.month and self.day == other.day and self.hour == other.hour and self.minute == other.minute and self.readings == other.readings and type(self) == type(other)
+    def __hash__(self):
+        #Consistent with __eq__, so rows can go in sets and dict keys
+        return hash((self.year, self.month, self.day, self.hour, self.minute, frozenset(self.readings.items())))
+
+
+class EnergyTable:
+    #Column storage for the daily readings: one typed array per field instead of
+    #one Energy object per day, and one kWh column per site. Iterating the table
+    #still hands out Energy rows, built on demand, so older code that loops over
+    #get_data() keeps working.
+    #Interval exports also fill the hour and minute columns; utc_offset is the
+    #timestamp's zone in minutes (PDT -420, PST -480) and interval the spacing
+    #of the rows in seconds, DAY for one row per day.
+    DATE_COLUMNS = ('year', 'month', 'day', 'hour', 'minute', 'utc_offset')
+
+    def __init__(self, sites=DEFAULT_SITES, interval=DAY):
+        self.sites = tuple(sites)
+        self.interval = interval
+        self.year = array('H')
+        self.month = array('B')
+        self.day = array('B')
+        self.hour = array('B')
+        self.minute = array('B')
+        self.utc_offset = array('h')
+        self.readings = {site: array('d') for site in self.sites}
+        self._index = None
+        self._summary = None
+        self._summarized = 0
+        self._fingerprint = None
+
+    @classmethod
+    def from_records(cls, records):
+        table = None
+        for energy in records:
+            if table is None:
+                table = cls(energy.readings)
+            table.append(energy.year, energy.month, energy.day, *energy.readings.values(),
+                         hour=energy.hour, minute=energy.minute, utc_offset=energy.utc_offset)
+        return table if table is not None else cls()
+
+    @classmethod
+    def from_rows(cls, sites, rows, interval=None):
+        #Builds a table from (year, month, day, hour, minute, utc_offset, *readings)
+        #tuples in one go; the interval is worked out from the times unless given
+        table = cls(sites, interval or DAY)
+        if rows:
+            year, month, day, hour, minute, utc_offset, *readings = zip(*rows)
+            table.year = array('H', year)
+            table.month = array('B', month)
+            table.day = array('B', day)
+            table.hour = array('B', hour)
+            table.minute = array('B', minute)
+            table.utc_offset = array('h', utc_offset)
+            table.interval = interval or guess_interval(table.hour, table.minute)
+            table.readings = {site: array('d', column) for site, column in zip(table.sites, readings)}
+        return table
+
+    def __getattr__(self, name):
+        #Site columns can be read as attributes, e.g. table.goldtree
+        if name != 'readings' and name in self.readings:
+            return self.readings[name]
+        raise AttributeError(name)
+
+    def append(self, year, month, day, *values, hour=0, minute=0, utc_offset=0):
+        #values are the site readings in self.sites order
+        self.year.append(year)
+        self.month.append(month)
+        self.day.append(day)
+        self.hour.append(hour)
+        self.minute.append(minute)
+        self.utc_offset.append(utc_offset)
+        if minute or hour:
+            self.interval = min(self.interval, gcd(minute, 60) * MINUTE if minute else HOUR)
+        for column, value in zip(self.readings.values(), values):
+            column.append(value)
+
+    def extend(self, other):
+        self.year.extend(other.year)
+        self.month.extend(other.month)
+        self.day.extend(other.day)
+        self.hour.extend(other.hour)
+        self.minute.extend(other.minute)
+        self.utc_offset.extend(other.utc_offset)
+        self.interval = min(self.interval, other.interval) if self else other.interval
+        for site, column in self.readings.items():
+            column.extend(other.readings[site])
+
+    def columns(self):
+        #(name, array) for every column: the date parts, then one per site
+        return [(name, getattr(self, name)) for name in self.DATE_COLUMNS] + list(self.readings.items())
+
+    def __len__(self):
+        return len(self.year)
+
+    def __iter__(self):
+        return map(self.__getitem__, range(len(self)))
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            table = EnergyTable(self.sites, self.interval)
+            table.year = self.year[index]
+            table.month = self.month[index]
+            table.day = self.day[index]
+            table.hour = self.hour[index]
+            table.minute = self.minute[index]
+            table.utc_offset = self.utc_offset[index]
+            table.readings = {site: column[index] for site, column in self.readings.items()}
+            return table
+        return Energy.from_readings(self.year[index], self.month[index], self.day[index],
+                                    {site: column[index] for site, column in self.readings.items()},
+                                    self.hour[index], self.minute[index], self.utc_offset[index])
+
+    def __repr__(self):
+        return 'EnergyTable({} days, sites={})'.format(len(self), list(self.sites))
+
+    def take(self, rows):
+        #New table holding the given row numbers, in that order
+        rows = list(rows)
+        table = EnergyTable(self.sites, self.interval)
+        for name, column in self.columns():
+            taken = array(column.typecode, map(column.__getitem__, rows))
+            if name in table.readings:
+                table.readings[name] = taken
+            else:
+                setattr(table, name, taken)
+        return table
+
+    def date_of(self, row):
+        return self.year[row], self.month[row], self.day[row]
+
+    def timestamps(self):
+        #Start of every row in seconds since 1970-01-01 UTC
+        n = len(self)
+        days = map(sub, map(date.toordinal, map(date, self.year, self.month, self.day)), repeat(EPOCH, n))
+        local = map(add, map(mul, days, repeat(DAY, n)),
+                    map(add, map(mul, self.hour, repeat(HOUR, n)), map(mul, self.minute, repeat(MINUTE, n))))
+        return array('q', map(sub, local, map(mul, self.utc_offset, repeat(MINUTE, n))))
+
+    @property
+    def summary(self):
+        #The table's EnergySummary rollup. Built on first use, then only rows
+        #added since are folded in. Interval tables start over instead, as the
+        #new rows may finish a day that was already summed.
+        if self._summary is None or (self.interval < DAY and self._summarized < len(self)):
+            from summary import EnergySummary
+            self._summary = EnergySummary()
+            self._summarized = 0
+        if self._summarized < len(self):
+            self._summary.update(self[self._summarized:])
+            self._summarized = len(self)
+        return self._summary
+
+    @property
+    def index(self):
+        #DateIndex over the rows, rebuilt only after rows have been added
+        if self._index is None or self._index.size != len(self):
+            self._index = DateIndex(self)
+        return self._index
+
+    def window(self, start=None, end=None):
+        #Rows dated from start to end inclusive, in date order. Either end may be
+        #None for an open range; dates can be date objects or 'YYYY-MM-DD'.
+        return self.index.select([self.index.span(start, end)])
+
+    def month_window(self, year, month):
+        first = date(year, month, 1)
+        last = date(year + month // 12, month % 12 + 1, 1).toordinal() - 1
+        return self.index.select([self.index.span(first, date.fromordinal(last))])
+
+    def season_window(self, name, years=None):
+        #Every day of a season, across all years in the table or just the given ones
+        index = self.index
+        if not index.keys:
+            return self[0:0]
+        if years is None:
+            years = range(date.fromordinal(index.keys[0]).year,
+                          date.fromordinal(index.keys[-1]).year + 1)
+        spans = []
+        for year in sorted(years):
+            for month in sorted(SEASONS[name]):
+                last = date(year + month // 12, month % 12 + 1, 1).toordinal() - 1
+                spans.append(index.span(date(year, month, 1), date.fromordinal(last)))
+        return index.select(spans)
+
+    def totals(self):
+        #Combined daily production of every site
+        totals = array('d', bytes(8 * len(self)))
+        for i, column in enumerate(self.readings.values()):
+            totals = array('d', column) if i == 0 else array('d', map(add, totals, column))
+        return totals
+
+    def month_runs(self):
+        #Splits the table into runs of rows from the same (year, month).
+        #Returns a list of ((year, month), start, stop); a month only shows up
+        #more than once if the rows are out of order.
+        n = len(self)
+        if n == 0:
+            return []
+        keys = array('l', map(add, map(mul, self.year, [12] * n), self.month))
+        starts = [0]
+        starts.extend(compress(range(1, n), map(ne, keys[1:], keys)))
+        stops = starts[1:] + [n]
+        return [((self.year[start], self.month[start]), start, stop)
+                for start, stop in zip(starts, stops)]
+
+
+def guess_interval(hours, minutes=()):
+    #Spacing of the rows from the times they start at: minutes of 0/15/30/45
+    #mean 15 minute readings, whole hours hourly ones, and only ever midnight
+    #one row per day
+    step = reduce(gcd, set(minutes), 0)
+    if step:
+        return gcd(step, 60) * MINUTE
+    return HOUR if any(hours) else DAY
+
+
+def to_date(value):
+    if value is None or isinstance(value, date):
+        return value
+    return date.fromisoformat(value)
+
+
+class DateIndex:
+    #Sorted day numbers for an EnergyTable so date windows are found with two
+    #binary searches. Exports are normally in date order, in which case a window
+    #is a plain slice of the table; otherwise the index keeps a sort order and
+    #windows are gathered through it.
+
+    def __init__(self, table):
+        self.table = table
+        self.size = len(table)
+        keys = array('l', map(date.toordinal, map(date, table.year, table.month, table.day)))
+        if all(map(le, keys, keys[1:])):
+            self.order = None
+            self.keys = keys
+        else:
+            order = sorted(range(len(keys)), key=keys.__getitem__)
+            self.order = array('l', order)
+            self.keys = array('l', map(keys.__getitem__, order))
+
+    def span(self, start=None, end=None):
+        #(lo, hi) positions in date order covering start..end inclusive
+        start, end = to_date(start), to_date(end)
+        lo = 0 if start is None else bisect_left(self.keys, start.toordinal())
+        hi = len(self.keys) if end is None else bisect_right(self.keys, end.toordinal())
+        return lo, max(lo, hi)
+
+    def select(self, spans):
+        #Table of the rows in the given spans, one contiguous slice per span when sorted
+        spans = [(lo, hi) for lo, hi in spans if hi > lo]
+        if self.order is None and len(spans) == 1:
+            return self.table[spans[0][0]:spans[0][1]]
+        if self.order is None:
+            rows = chain.from_iterable(range(lo, hi) for lo, hi in spans)
+        else:
+            rows = chain.from_iterable(self.order[lo:hi] for lo, hi in spans)
+        return self.table.take(rows)
+
+
+def as_table(data):
+    #Lets every report take either an EnergyTable or a plain list of Energy
+    if isinstance(data, EnergyTable):
+        return data
+    return EnergyTable.from_records(data)
+
+
+def iter_batches(data, batch_size=BATCH_SIZE):
+    #Turns an EnergyTable, a stream of EnergyTable batches or a stream of Energy
+    #records into EnergyTable batches, holding at most batch_size rows at a time.
+    #A new batch is started whenever the records switch to a different set of sites.
+    if isinstance(data, EnergyTable):
+        yield data
+        return
+    pending = None
+    for item in data:
+        if isinstance(item, EnergyTable):
+            if pending:
+                yield pending
+            pending = None
+            yield item
+            continue
+        if pending is None or tuple(item.readings) != pending.sites:
+            if pending:
+                yield pending
+            pending = EnergyTable(item.readings)
+        pending.append(item.year, item.month, item.day, *item.readings.values(),
+                       hour=item.hour, minute=item.minute, utc_offset=item.utc_offset)
+        if len(pending) >= batch_size:
+            yield pending
+            pending = None
+    if pending:
+        yield pending
+
+
+def site_key(name):
+    #'Cal Poly Gold Tree Solar (C) Total Meter Energy' -> 'goldtree'
+    #'Poly Canyon Total Meter Energy' -> 'poly_canyon'
+    if name in SITE_KEYS:
+        return SITE_KEYS[name]
+    name = re.sub(r'\s*total meter energy$', '', name, flags=re.IGNORECASE)
+    return re.sub(r'[^0-9a-z]+', '_', name.lower()).strip('_') or 'site'
 
-    return data
 
+class Schema:
+    #Where each site's readings live in an export. The header names one column
+    #per meter after the Timestamp; those hold display strings like '35500.0kWh'.
+    #When the header ends in as many unnamed columns as there are meters, those
+    #carry the raw numbers and are read instead, as the Cal Poly export does.
+
+    def __init__(self, sites, value_columns, width, raw_values=True, header_lines=1):
+        self.sites = tuple(sites)
+        self.value_columns = tuple(value_columns)
+        self.width = width
+        self.raw_values = raw_values
+        self.header_lines = header_lines
+
+    @classmethod
+    def from_header(cls, line):
+        cells = [cell.strip() for cell in line.rstrip('\r\n').split(',')]
+        named = [i for i in range(1, len(cells)) if cells[i]]
+        unnamed = [i for i in range(1, len(cells)) if not cells[i]]
+        sites = []
+        for i in named:
+            key = name = site_key(cells[i])
+            n = 2
+            while key in sites:
+                key, n = f'{name}_{n}', n + 1
+            sites.append(key)
+        raw_values = len(unnamed) == len(named)
+        value_columns = unnamed if raw_values else named
+        return cls(sites, value_columns, len(cells), raw_values)
+
+    @classmethod
+    def default(cls):
+        #The layout of the Cal Poly export, for files without a header line
+        return cls(DEFAULT_SITES, (3, 4), 5, header_lines=0)
+
+    def __repr__(self):
+        return f'Schema(sites={list(self.sites)}, value_columns={list(self.value_columns)})'
+
+
+def split_header(lines):
+    #Returns (schema, remaining lines). A first line that doesn't start with a
+    #date is the header; otherwise the Cal Poly layout is assumed.
+    lines = iter(lines)
+    first = next(lines, '')
+    if first[:1].isdigit():
+        return Schema.default(), chain([first], lines)
+    return Schema.from_header(first), lines
+
+
+def parse_value(cell):
+    return float(cell.strip().removesuffix('kWh'))
+
+
+class Quarantine:
+    #Rows the parser refused. Every rejection is counted by reason, and the first
+    #`keep` of them are also kept as (line number, reason, row text).
+
+    def __init__(self, keep=1000):
+        self.keep = keep
+        self.counts = {}
+        self.rows = []
+
+    def add(self, line_number, reason, row):
+        self.counts[reason] = self.counts.get(reason, 0) + 1
+        if len(self.rows) < self.keep:
+            self.rows.append((line_number, reason, ','.join(row)))
+
+    def __len__(self):
+        return sum(self.counts.values())
+
+    def __repr__(self):
+        return f'Quarantine({len(self)} rows, {self.counts})'
+
+
+def reject_reason(row, schema):
+    #Works out why parse_lines turned a row down
+    if not any(cell.strip() for cell in row):
+        return 'blank line'
+    if len(row) != schema.width:
+        return 'wrong column count'
+    try:
+        date(int(row[0][:4]), int(row[0][5:7]), int(row[0][8:10]))
+    except ValueError:
+        return 'bad timestamp'
+    if not row[0][:4].isdigit():
+        return 'bad timestamp'
+    if row[0][4:5] != '-' or row[0][7:8] != '-':
+        return 'bad timestamp'
+    if row[0][11:13] not in HOURS or row[0][14:16] not in MINUTES:
+        return 'bad timestamp'
+    try:
+        zone_offset(row[0][19:])
+    except ValueError:
+        return 'bad timestamp'
+    try:
+        values = [parse_value(row[i]) for i in schema.value_columns]
+    except ValueError:
+        return 'unreadable reading'
+    if not all(map(isfinite, values)):
+        return 'non-finite reading'
+    return 'zero reading'
+
+
+def parse_lines(lines, schema, quarantine=None, line_offset=None):
+    #Yields (year, month, day, hour, minute, utc_offset, *site readings) for every
+    #usable line of an export; the time is midnight when the timestamp has none.
+    #Rows with the wrong number of cells, a bad timestamp, or a zero, missing or
+    #non-numeric reading for any site are rejected, and recorded with their line
+    #number and reason when a Quarantine is passed in. Good rows go through a
+    #straight-line fast path; working out the reason is left to reject_reason.
+    if line_offset is None:
+        line_offset = schema.header_lines
+    reader = csv.reader(lines)
+    width = schema.width
+    columns = schema.value_columns
+    pick = itemgetter(*columns) if len(columns) > 1 else (lambda row: (row[columns[0]],))
+    convert = float if schema.raw_values else parse_value
+    for row in reader:
+        if len(row) == width:
+            stamp = row[0]
+            try:
+                year, month, day = int(stamp[:4]), int(stamp[5:7]), int(stamp[8:10])
+                #A real calendar date with a four digit year; 2024-02-30,
+                #0000-07-01 and -024-07-01 all raise ValueError here
+                if not stamp[:4].isdigit():
+                    raise ValueError(stamp)
+                date(year, month, day)
+                hour = HOURS[stamp[11:13]]
+                minute = MINUTES[stamp[14:16]]
+                offset = zone_offset(stamp[19:])
+                values = tuple(map(convert, pick(row)))
+            except (ValueError, KeyError):
+                values = None
+            if (values is not None and stamp[4:5] == '-' and stamp[7:8] == '-'
+                    and 0.0 not in values and isfinite(sum(values))):
+                yield (year, month, day, hour, minute, offset) + values
+                continue
+        if quarantine is not None:
+            quarantine.add(reader.line_num + line_offset, reject_reason(row, schema), row)
+
+
+def read_blocks(source, size=BLOCK_SIZE):
+    #Yields blocks of whole lines, about size characters each, from an open
+    #file or from any iterable of lines
+    if hasattr(source, 'read'):
+        rest = ''
+        while True:
+            block = source.read(size)
+            if not block:
+                break
+            block = rest + block
+            cut = block.rfind('\n') + 1
+            rest = block[cut:]
+            if cut:
+                yield block[:cut]
+        if rest:
+            yield rest + '\n'
+        return
+    lines = iter(source)
+    while True:
+        block = ''.join(islice(lines, size // 64))
+        if not block:
+            return
+        yield block if block.endswith('\n') else block + '\n'
+
+
+#Month and day of a timestamp, stamp[5:7] and stamp[8:10], in range; days past
+#the 28th are checked against their month after
+MONTHS = {f'{n:02d}': n for n in range(1, 13)}
+DAYS = {f'{n:02d}': n for n in range(1, 32)}
+#Hour and minute of a timestamp's time part, stamp[11:13] and stamp[14:16];
+#a bare date counts as midnight
+HOURS = {f'{n:02d}': n for n in range(24)}
+HOURS[''] = 0
+MINUTES = {f'{n:02d}': n for n in range(60)}
+MINUTES[''] = 0
+#Offsets in minutes for the zone part of a timestamp, stamp[19:], as it appears
+#in the file; filled in by zone_offset as new spellings turn up
+ZONE_NAMES = {'PDT': -420, 'PST': -480, 'UTC': 0, 'GMT': 0, 'Z': 0, '': 0}
+ZONE_OFFSETS = {}
+
+
+def zone_offset(text):
+    #' PDT' -> -420, '-07:00' -> -420, '+0530' -> 330; raises ValueError
+    offset = ZONE_OFFSETS.get(text)
+    if offset is not None:
+        return offset
+    name = text.strip()
+    if name in ZONE_NAMES:
+        offset = ZONE_NAMES[name]
+    else:
+        match = re.fullmatch(r'([+-])(\d\d):?(\d\d)', name)
+        if match is None:
+            raise ValueError(f'unknown time zone {name!r}')
+        offset = int(match[2]) * 60 + int(match[3])
+        if match[1] == '-':
+            offset = -offset
+    ZONE_OFFSETS[text] = offset
+    return offset
+
+
+def parse_block(block, schema):
+    #Bulk path for a block of lines that are all clean: the whole block is split
+    #into one flat list of cells and each column is converted with a single map()
+    #over a stride of that list. Returns None as soon as anything looks off
+    #(quotes, a ragged line, a bad date, a zero or unreadable reading), and the
+    #caller re-reads that block row by row with parse_lines, so one bad row only
+    #costs the slow path for its own block.
+    width = schema.width
+    if '"' in block:
+        return None
+    if '\r' in block:
+        block = block.replace('\r', '')
+    cells = block.replace('\n', ',').split(',')
+    del cells[-1]
+    if len(cells) != block.count('\n') * width:
+        return None
+    #A ragged line shifts the cells after it, which puts readings in the
+    #timestamp stride and fails the date checks below
+    stamps = cells[0::width]
+    if (set(map(itemgetter(slice(4, 5)), stamps)) != {'-'}
+            or set(map(itemgetter(slice(7, 8)), stamps)) != {'-'}):
+        return None
+    #Four digit unsigned years only; int() would take '-024' or '+024'
+    years = ''.join(map(itemgetter(slice(0, 4)), stamps))
+    if len(years) != 4 * len(stamps) or not years.isdigit():
+        return None
+    convert = float if schema.raw_values else parse_value
+    table = EnergyTable(schema.sites)
+    try:
+        table.year = array('H', map(int, map(itemgetter(slice(0, 4)), stamps)))
+        table.month = array('B', map(MONTHS.__getitem__, map(itemgetter(slice(5, 7)), stamps)))
+        table.day = array('B', map(DAYS.__getitem__, map(itemgetter(slice(8, 10)), stamps)))
+        table.hour = array('B', map(HOURS.__getitem__, map(itemgetter(slice(11, 13)), stamps)))
+        table.minute = array('B', map(MINUTES.__getitem__, map(itemgetter(slice(14, 16)), stamps)))
+        #Zone spellings not seen before are learned on the row path
+        table.utc_offset = array('h', map(ZONE_OFFSETS.__getitem__, map(itemgetter(slice(19, None)), stamps)))
+        table.interval = guess_interval(table.hour, table.minute)
+        for site, column in zip(table.sites, schema.value_columns):
+            values = array('d', map(convert, cells[column::width]))
+            if 0.0 in values or not isfinite(sum(values)):
+                return None
+            table.readings[site] = values
+    except (ValueError, OverflowError, KeyError):
+        return None
+    #Month and day are in range already; only the 29th to 31st can fall off
+    #the end of a month, and a block has a handful of those (year 0 fails too)
+    try:
+        for day in set(compress(zip(table.year, table.month, table.day), map((28).__lt__, table.day))):
+            date(*day)
+        if 0 in table.year:
+            return None
+    except ValueError:
+        return None
+    return table
+
+
+def parse_blocks(source, schema, quarantine=None, line_offset=None):
+    #Yields an EnergyTable per block of source (an open file or lines, already
+    #past the header), using parse_block and falling back to parse_lines.
+    #line_offset is the number of lines before source, for quarantine line
+    #numbers; by default the header's.
+    line_number = schema.header_lines if line_offset is None else line_offset
+    for block in read_blocks(source):
+        table = parse_block(block, schema)
+        if table is None:
+            rows = list(parse_lines(block.splitlines(keepends=True), schema, quarantine, line_number))
+            table = EnergyTable.from_rows(schema.sites, rows)
+        line_number += block.count('\n')
+        if table:
+            yield table
+
+
+#First bytes of the compressed formats open_export reads
+GZIP_MAGIC = b'\x1f\x8b'
+BZIP2_MAGIC = b'BZh'
+XZ_MAGIC = b'\xfd7zXZ\x00'
+
+
+def open_export(path):
+    #Opens an export as text, decompressing gzip, bz2 and xz files as they are
+    #read (told apart by their first bytes, whatever the file is called), so
+    #an archived export never has to be unpacked to disk
+    with open(path, 'rb') as f:
+        magic = f.read(6)
+    if magic.startswith(GZIP_MAGIC):
+        import gzip
+        return gzip.open(path, 'rt', newline='')
+    if magic.startswith(BZIP2_MAGIC):
+        import bz2
+        return bz2.open(path, 'rt', newline='')
+    if magic.startswith(XZ_MAGIC):
+        import lzma
+        return lzma.open(path, 'rt', newline='')
+    return open(path, newline='')
+
+
+def read_schema(path):
+    with open_export(path) as f:
+        return split_header(f)[0]
+
+
+def iter_data(path_or_file=DATA_FILE, batch_size=None, quarantine=None):
+    #Lazily reads an export from a path (plain or compressed, see open_export)
+    #or an open text file. Yields Energy records, or EnergyTable batches of up
+    #to batch_size rows if one is given. Either way only the current record or
+    #batch is kept in memory.
+    if isinstance(path_or_file, (str, bytes, os.PathLike)):
+        with open_export(path_or_file) as f:
+            yield from iter_data(f, batch_size, quarantine)
+        return
+    schema, lines = split_header(path_or_file)
+    tables = parse_blocks(lines, schema, quarantine)
+    if batch_size is None:
+        for table in tables:
+            yield from table
+        return
+    batch = EnergyTable(schema.sites)
+    for table in tables:
+        batch.extend(table)
+        while len(batch) >= batch_size:
+            yield batch[:batch_size]
+            batch = batch[batch_size:]
+    if batch:
+        yield batch
+
+
+@profiled(rows='result')
+def get_data(path=DATA_FILE, cache=True, quarantine=None):
+    #With cache on, a parsed copy is kept next to the CSV (see datacache.py)
+    #and reused until the CSV changes. Passing a Quarantine always re-parses,
+    #so it gets filled in.
+    if cache:
+        import datacache
+        data = None if quarantine is not None else datacache.load(path)
+        if data is not None:
+            return data
+    data = EnergyTable(read_schema(path).sites)
+    for batch in iter_data(path, BATCH_SIZE, quarantine):
+        data.extend(batch)
+    if cache:
+        datacache.save(path, data)
+    return data
@@ -0,0 +1,118 @@
+#On-disk cache of parsed exports, so a warm get_data() skips the CSV parse.
+#
+#Each CSV gets a file in an __energycache__ folder beside it:
+#    MAGIC, 4 byte header length, JSON header, padding, raw column bytes
+#The header records the source file's size, mtime and sha256, the site names,
+#the row interval, and where each EnergyTable column sits in the file. Columns
+#are 8 byte aligned, so the file can be memory mapped and each column copied out with a single frombytes.
+import hashlib
+import json
+import mmap
+import os
+import struct
+import sys
+from array import array
+
+from builddata import EnergyTable
+
+MAGIC = b'ENERGY4\n'
+CACHE_DIR = '__energycache__'
+
+
+def cache_path(path):
+    folder, name = os.path.split(os.path.abspath(path))
+    return os.path.join(folder, CACHE_DIR, name + '.bin')
+
+
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _read_header(mm):
+    if mm[:len(MAGIC)] != MAGIC:
+        return None
+    start = len(MAGIC) + 4
+    (length,) = struct.unpack('<I', mm[len(MAGIC):start])
+    return json.loads(mm[start:start + length])
+
+
+def load(path):
+    #Returns the cached EnergyTable for path, or None if there is no usable cache.
+    #Size and mtime are checked first; only when they disagree is the CSV hashed,
+    #so a touched-but-unchanged file still hits the cache.
+    target = cache_path(path)
+    try:
+        stat = os.stat(path)
+        with open(target, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            header = _read_header(mm)
+            if header is None or header['byteorder'] != sys.byteorder:
+                return None
+            if header['size'] != stat.st_size:
+                return None
+            if header['mtime_ns'] != stat.st_mtime_ns and header['sha256'] != file_hash(path):
+                return None
+            table = EnergyTable(header['sites'], header['interval'])
+            with memoryview(mm) as view:
+                for name, typecode, offset, nbytes in header['columns']:
+                    column = array(typecode)
+                    column.frombytes(view[offset:offset + nbytes])
+                    if name in table.readings:
+                        table.readings[name] = column
+                    else:
+                        setattr(table, name, column)
+    except (OSError, ValueError, KeyError):
+        return None
+    if header['mtime_ns'] != stat.st_mtime_ns:
+        save(path, table, header['sha256'])
+    return table
+
+
+def save(path, table, sha256=None):
+    #Writes the cache for path; a failed write just leaves the cache cold
+    target = cache_path(path)
+    try:
+        stat = os.stat(path)
+        header = {
+            'size': stat.st_size,
+            'mtime_ns': stat.st_mtime_ns,
+            'sha256': sha256 or file_hash(path),
+            'byteorder': sys.byteorder,
+            'rows': len(table),
+            'sites': list(table.sites),
+            'interval': table.interval,
+            'columns': [],
+        }
+        columns = [(name, column.typecode) for name, column in table.columns()]
+        blobs = [column.tobytes() for name, column in table.columns()]
+        #Offsets depend on the header length and the header lists the offsets,
+        #so lay the columns out again until the two agree
+        while True:
+            encoded = json.dumps(header).encode()
+            offset = _align(len(MAGIC) + 4 + len(encoded))
+            layout = []
+            for (name, typecode), blob in zip(columns, blobs):
+                layout.append([name, typecode, offset, len(blob)])
+                offset = _align(offset + len(blob))
+            if layout == header['columns']:
+                break
+            header['columns'] = layout
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        temp = target + '.tmp'
+        with open(temp, 'wb') as f:
+            f.write(MAGIC)
+            f.write(struct.pack('<I', len(encoded)))
+            f.write(encoded)
+            for (name, typecode, offset, nbytes), blob in zip(header['columns'], blobs):
+                f.write(b'\0' * (offset - f.tell()))
+                f.write(blob)
+        os.replace(temp, target)
+    except OSError:
+        pass
+
+
+def _align(offset):
+    return (offset + 7) // 8 * 8
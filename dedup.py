@@ -0,0 +1,104 @@
+#Merging exports that overlap, such as a year re-downloaded a few weeks after
+#the last one. Each site's readings are kept in a dict keyed by UTC timestamp,
+#so a reading seen in an earlier export is found with one hash lookup and any
+#number of exports merge in time linear in their total size.
+#
+#    report = MergeReport()
+#    table = merge_exports(['2024.csv', '2024-redownload.csv'], 'latest', report)
+#    total_cost_savings(table)                  # each day counted once
+#
+#Conflict policies, for a reading whose value differs between exports:
+#    'latest'  the export listed later wins
+#    'max'     the larger reading wins
+#    'flag'    the first export's reading is kept and the conflict is recorded
+#A reading repeated with the same value is a duplicate, not a conflict. The
+#report counts rows: a row seen before is a duplicate if every site's reading
+#matches, and replaced if the policy took a new reading for any of its sites.
+from array import array
+
+from builddata import DAY, EnergyTable, get_data
+
+POLICIES = ('latest', 'max', 'flag')
+
+
+class MergeReport:
+    #What merge_exports did: rows read, duplicate rows dropped, rows with a
+    #reading replaced under the policy, and conflicts (one per reading) as
+    #(site, timestamp, kept, other, export number), the first `keep` of them kept
+
+    def __init__(self, keep=1000):
+        self.keep = keep
+        self.rows = 0
+        self.duplicates = 0
+        self.replaced = 0
+        self.incomplete = 0
+        self.conflicts = []
+        self.conflict_count = 0
+
+    def add_conflict(self, site, stamp, kept, other, source):
+        self.conflict_count += 1
+        if len(self.conflicts) < self.keep:
+            self.conflicts.append((site, stamp, kept, other, source))
+
+    def __repr__(self):
+        return (f'MergeReport({self.rows} rows, {self.duplicates} duplicates, '
+                f'{self.replaced} replaced, {self.conflict_count} conflicts)')
+
+
+def merge_exports(sources, policy='latest', report=None):
+    #Merges CSV paths and/or EnergyTables into one EnergyTable in time order.
+    #Sites are the union over the exports; a timestamp is kept only if every
+    #site has a reading for it (the others are counted as incomplete).
+    if policy not in POLICIES:
+        raise ValueError(f'unknown merge policy {policy!r}, expected one of {POLICIES}')
+    if report is None:
+        report = MergeReport()
+    readings = {}
+    times = {}
+    interval = None
+    for number, source in enumerate(sources):
+        table = source if isinstance(source, EnergyTable) else get_data(source)
+        report.rows += len(table)
+        stamps = table.timestamps()
+        interval = table.interval if interval is None else min(interval, table.interval)
+        #Later exports also win for the local date parts of a timestamp
+        times.update(zip(stamps, zip(*(getattr(table, name) for name in EnergyTable.DATE_COLUMNS))))
+        #Timestamps of this export seen before, those with any reading that
+        #differs, and those with any reading replaced
+        overlap, differing, changed = set(), set(), set()
+        for site, column in table.readings.items():
+            new = dict(zip(stamps, column))
+            seen = readings.get(site)
+            if seen is None:
+                readings[site] = new
+                continue
+            common = seen.keys() & new.keys()
+            overlap |= common
+            for stamp in common:
+                old, value = seen[stamp], new[stamp]
+                if old == value:
+                    continue
+                differing.add(stamp)
+                if policy == 'latest' or (policy == 'max' and value > old):
+                    seen[stamp] = value
+                    changed.add(stamp)
+                elif policy == 'flag':
+                    report.add_conflict(site, stamp, old, value, number)
+            #Timestamps new to this site; overlaps were settled above
+            for stamp in new.keys() - seen.keys():
+                seen[stamp] = new[stamp]
+        report.duplicates += len(overlap - differing)
+        report.replaced += len(changed)
+    sites = list(readings)
+    result = EnergyTable(sites, interval or DAY)
+    complete = set(times)
+    for column in readings.values():
+        complete &= column.keys()
+    report.incomplete = len(times) - len(complete)
+    order = sorted(complete)
+    if order:
+        for name, column in zip(EnergyTable.DATE_COLUMNS, zip(*map(times.__getitem__, order))):
+            setattr(result, name, array(getattr(result, name).typecode, column))
+        for site in sites:
+            result.readings[site] = array('d', map(readings[site].__getitem__, order))
+    return result
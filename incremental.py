@@ -0,0 +1,125 @@
+#Append-only ingestion: keeps a running EnergySummary for an export on disk and,
+#on each refresh, parses only the lines added to the CSV since the last one.
+#
+#    feed = IncrementalSummary('Solar data cal poly csv.csv')
+#    summary = feed.refresh()
+#    comprehensive_cost_analysis(summary)
+#
+#The state file records the byte offset reached, the header line and the
+#summary itself. If the CSV shrinks or its header changes it is no longer an
+#append of what was seen, and the summary is rebuilt from the start.
+#
+#update() sums each day whole, so for interval exports the lines of a last day
+#that isn't over yet are left unread: the offset stops at its first line and
+#the next refresh reads the day again from there.
+import json
+import os
+
+from builddata import DAY, HOUR, MINUTE, EnergyTable, parse_blocks, parse_lines, split_header
+from datacache import CACHE_DIR
+from summary import EnergySummary
+
+
+def state_path(path):
+    folder, name = os.path.split(os.path.abspath(path))
+    return os.path.join(folder, CACHE_DIR, name + '.state.json')
+
+
+class IncrementalSummary:
+
+    def __init__(self, path, state_file=None):
+        self.path = path
+        self.state_file = state_file or state_path(path)
+        self.offset = 0
+        self.header = None
+        self.summary = EnergySummary()
+        self.interval = DAY
+        self.rows_added = 0
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.state_file) as f:
+                state = json.load(f)
+            self.offset = state['offset']
+            self.header = state['header']
+            self.summary = EnergySummary.from_dict(state['summary'])
+            self.interval = state.get('interval', DAY)
+        except (OSError, ValueError, KeyError):
+            self.offset = 0
+            self.header = None
+            self.summary = EnergySummary()
+            self.interval = DAY
+
+    def save(self):
+        state = {
+            'source': os.path.abspath(self.path),
+            'offset': self.offset,
+            'header': self.header,
+            'interval': self.interval,
+            'summary': self.summary.to_dict(),
+        }
+        os.makedirs(os.path.dirname(self.state_file), exist_ok=True)
+        temp = self.state_file + '.tmp'
+        with open(temp, 'w') as f:
+            json.dump(state, f)
+        os.replace(temp, self.state_file)
+
+    def _count(self, tables):
+        for table in tables:
+            self.rows_added += len(table)
+            self.interval = min(self.interval, table.interval)
+            yield table
+
+    def refresh(self, save=True):
+        #Folds in the complete lines appended since the last refresh and returns
+        #the up to date summary. A trailing line without a newline is left for
+        #the next refresh, in case the writer is still part way through it.
+        with open(self.path, 'rb') as f:
+            header = f.readline().decode()
+            if f.seek(0, os.SEEK_END) < self.offset or header != self.header:
+                self.offset = 0
+                self.header = header
+                self.summary = EnergySummary()
+                self.interval = DAY
+            f.seek(self.offset)
+            new = f.read()
+        end = new.rfind(b'\n') + 1
+        lines = new[:end].decode().splitlines(keepends=True)
+        if self.offset and not header[:1].isdigit():
+            lines.insert(0, header)
+        schema, lines = split_header(lines)
+        lines = list(lines)
+        cut = _last_day_start(lines)
+        self.rows_added = 0
+        self.summary.update(self._count(parse_blocks(lines[:cut], schema)))
+        #The last day's lines on their own; a lone midnight reading looks
+        #daily, so the interval seen so far counts too
+        last = EnergyTable.from_rows(schema.sites, list(parse_lines(lines[cut:], schema)))
+        if last:
+            last.interval = min(last.interval, self.interval)
+            if last.interval < DAY and not _day_is_over(last):
+                end -= len(''.join(lines[cut:]).encode())
+            else:
+                self.summary.update(self._count([last]))
+        self.offset += end
+        if save:
+            self.save()
+        return self.summary
+
+
+def _last_day_start(lines):
+    #Index of the first of the trailing lines dated the same as the last one
+    row = len(lines)
+    while row and not lines[row - 1].strip():
+        row -= 1
+    day = lines[row - 1][:10] if row else None
+    while row and lines[row - 1][:10] == day:
+        row -= 1
+    return row
+
+
+def _day_is_over(table):
+    #Whether the latest reading of the table's one day runs to midnight
+    last = max(hour * HOUR + minute * MINUTE for hour, minute in zip(table.hour, table.minute))
+    return last + table.interval >= DAY
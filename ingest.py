@@ -0,0 +1,134 @@
+#Reading many exports at once (one per site per year, say). Each file is
+#summarized on its own in a worker process and the partial summaries are merged
+#in file order, so the wall-clock time follows the number of cores rather than
+#the number of files. Files holding different sites are joined by date (see
+#join_parts), so the combined daily figures add the sites up day by day.
+#
+#    summary = summarize_files('exports/')        # or 'exports/*.csv', or a list
+#    summary = summarize_files('archive/2019-2023.zip')
+#    seasonal_analysis(summary)
+#
+#Exports may be gzip, bz2 or xz compressed (see builddata.open_export), and a
+#zip archive counts as one source per .csv inside it. Each worker opens and
+#decompresses its own file or member, so decompression runs in parallel too.
+#A .tar.gz is one compressed stream that can only be read from the start, so
+#it has to be unpacked or recompressed per file to be read in parallel.
+import glob
+import io
+import os
+import zipfile
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from itertools import compress
+from operator import add
+
+from builddata import BATCH_SIZE, DAY, EnergyTable, iter_data
+from resample import resample
+from summary import PROFILE_SIZE, EnergySummary
+
+EXPORT_PATTERNS = ('*.csv', '*.csv.gz', '*.csv.bz2', '*.csv.xz', '*.zip')
+
+
+def find_files(source):
+    #A directory (every export and zip archive in it), a glob pattern, a single
+    #path or a list of paths. Zip archives are expanded to (archive, member) pairs, one per
+    #.csv inside; zip compresses them already.
+    if isinstance(source, (str, os.PathLike)):
+        source = os.fspath(source)
+        if os.path.isdir(source):
+            paths = sorted(path for pattern in EXPORT_PATTERNS for path in glob.glob(os.path.join(source, pattern)))
+        elif glob.has_magic(source):
+            paths = sorted(glob.glob(source))
+        else:
+            paths = [source]
+    else:
+        paths = [os.fspath(path) for path in source]
+    found = []
+    for path in paths:
+        if zipfile.is_zipfile(path):
+            with zipfile.ZipFile(path) as archive:
+                found.extend((path, name) for name in sorted(archive.namelist()) if name.endswith('.csv'))
+        else:
+            found.append(path)
+    return found
+
+
+def _read(source):
+    #EnergyTable batches of a path or an (archive, member) pair from find_files
+    if isinstance(source, str):
+        yield from iter_data(source, BATCH_SIZE)
+        return
+    path, member = source
+    with zipfile.ZipFile(path) as archive, archive.open(member) as f:
+        yield from iter_data(io.TextIOWrapper(f, newline=''), BATCH_SIZE)
+
+
+def _by_hour(tables, hours):
+    #Passes the tables through, appending each one's readings added up by hour
+    #to hours. An hour cut in two by a batch boundary gives two rows, which is
+    #harmless: they are only ever summed again, by day or by profile slot.
+    for table in tables:
+        yield table
+        hours.append(resample(table, 'hour'))
+
+
+def summarize_file(source):
+    return summarize_part(source)[0]
+
+
+def summarize_part(source):
+    #(summary, hourly table) for one export; daily exports keep their days.
+    #The hourly table is what lets exports holding different sites be joined
+    #day by day and still give time-of-day profiles for the joined days only.
+    hours = []
+    summary = EnergySummary().update(_by_hour(_read(source), hours))
+    hourly = EnergyTable(hours[0].sites if hours else (), hours[0].interval if hours else DAY)
+    for table in hours:
+        hourly.extend(table)
+    return summary, hourly
+
+
+def merge_summaries(summaries):
+    #Merging is associative, so partials can be combined in any grouping
+    result = EnergySummary()
+    for summary in summaries:
+        result.merge(summary)
+    return result
+
+
+def join_parts(parts):
+    #Combines summarize_part results. Exports of the same sites cover
+    #different days and their summaries just merge. Exports of different
+    #sites (one per site per year, say) cover the same days, so their daily
+    #readings are joined by date first (see dedup.merge_exports; days missing
+    #a site are left out, as the CSV loader leaves them out) and the combined
+    #stats are built from the joined days. Time-of-day profiles are summed
+    #per site from each export's hours on the joined days.
+    parts = [(summary, hourly) for summary, hourly in parts if hourly]
+    if len({hourly.sites for summary, hourly in parts}) < 2:
+        return merge_summaries(summary for summary, hourly in parts)
+    from dedup import merge_exports
+    joined = merge_exports([resample(hourly, 'day') for summary, hourly in parts])
+    months = EnergySummary().update(joined).months
+    kept = set(zip(joined.year, joined.month, joined.day))
+    for key, group in months.items():
+        group.profile = array('d', bytes(8 * PROFILE_SIZE))
+        for stats in group.sites.values():
+            stats.profile = array('d', bytes(8 * PROFILE_SIZE))
+    for summary, hourly in parts:
+        rows = compress(range(len(hourly)), map(kept.__contains__, zip(hourly.year, hourly.month, hourly.day)))
+        for key, other in EnergySummary().update(hourly.take(rows)).months.items():
+            group = months[key]
+            for site, stats in other.sites.items():
+                group.sites[site].profile = array('d', map(add, group.sites[site].profile, stats.profile))
+                group.profile = array('d', map(add, group.profile, stats.profile))
+    return EnergySummary.from_months(months)
+
+
+def summarize_files(source, processes=None):
+    #processes=None uses every core; processes=1 reads the files in this process
+    paths = find_files(source)
+    if processes == 1 or len(paths) < 2:
+        return join_parts(map(summarize_part, paths))
+    with ProcessPoolExecutor(processes) as pool:
+        return join_parts(pool.map(summarize_part, paths))
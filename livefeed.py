@@ -0,0 +1,310 @@
+#Live readings from meter gateways, folded into running summaries as they
+#arrive, so every report in Analysis.py and CostSavings.py stays current.
+#
+#    async with LiveIngest() as ingest:
+#        await ingest.serve('0.0.0.0', 9300)             # gateways push to us
+#        ingest.follow('gateway-7', 9300)                # or we read from them
+#        ingest.follow('gateway-8', 80, '/feed')         # over HTTP
+#        ...
+#        production_analysis(ingest.summary)
+#
+#A feed is a stream of lines in the export's own format: an optional header
+#line naming the meters, then one line per reading. Each connection is one
+#coroutine, so thousands of them share a single thread. Parsed rows go through
+#a bounded queue to one consumer that adds them to the summary for the feed's
+#set of meters, batch_size rows (or flush_interval seconds) at a time. When the
+#consumer falls behind, the queue fills, feed coroutines wait on it and stop
+#reading, and TCP pushes back on the gateways instead of memory growing.
+#
+#Interval rows of the newest day are held back until the day is over (or the
+#ingest stops), since update() sums each day whole; snapshot() includes them.
+#Feeds for the same meters should cover different times, such as one gateway
+#reconnecting, or readings will be counted twice.
+import asyncio
+
+from builddata import BATCH_SIZE, DAY, EnergyTable, parse_blocks, split_header
+from summary import EnergySummary, last_day_start
+
+QUEUE_SIZE = 256
+FLUSH_INTERVAL = 1.0
+READ_SIZE = 1 << 16
+BACKLOG = 4096
+
+
+class LiveIngest:
+
+    def __init__(self, batch_size=BATCH_SIZE, queue_size=QUEUE_SIZE, flush_interval=FLUSH_INTERVAL, quarantine=None):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.quarantine = quarantine
+        self.queue = asyncio.Queue(queue_size)
+        #One summary and one table of rows not yet added per set of meters
+        self.summaries = {}
+        self.pending = {}
+        self.intervals = {}
+        self.pending_rows = 0
+        self.unflushed = 0
+        self.rows = 0
+        self.open_feeds = 0
+        self.peak_feeds = 0
+        self.connections = 0
+        self.errors = 0
+        self._servers = []
+        self._tasks = set()
+        self._consumer = None
+
+    async def __aenter__(self):
+        self.start()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.stop()
+
+    def start(self):
+        if self._consumer is None:
+            self._consumer = asyncio.get_running_loop().create_task(self._consume())
+
+    async def stop(self):
+        #Closes the servers and feeds, adds every row still queued or held back
+        for server in self._servers:
+            server.close()
+        for task in list(self._tasks):
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        await self.queue.join()
+        if self._consumer is not None:
+            self._consumer.cancel()
+            await asyncio.gather(self._consumer, return_exceptions=True)
+            self._consumer = None
+        self._flush(final=True)
+
+    async def drain(self):
+        #Waits until everything received so far is in the summaries, except
+        #the held back rows of the newest day
+        await self.queue.join()
+        self._flush()
+
+    async def serve(self, host='127.0.0.1', port=0):
+        #Accepts gateways that connect and push their readings; returns the
+        #asyncio server (its sockets give the port when 0 was asked for)
+        self.start()
+        server = await asyncio.start_server(self._accept, host, port, backlog=BACKLOG)
+        self._servers.append(server)
+        return server
+
+    async def _accept(self, reader, writer):
+        task = asyncio.current_task()
+        self._tasks.add(task)
+        try:
+            await self.feed(reader)
+        finally:
+            self._tasks.discard(task)
+            writer.close()
+
+    def follow(self, host, port, path=None, reconnect=None):
+        #Reads a feed from a gateway, over plain TCP or, given a path, as an
+        #HTTP GET, in a task of its own which is returned. With reconnect
+        #(seconds) it keeps coming back after the connection drops until
+        #stop(); otherwise the task ends with the feed.
+        self.start()
+        task = asyncio.get_running_loop().create_task(self._follow(host, port, path, reconnect))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    async def _follow(self, host, port, path, reconnect):
+        while True:
+            try:
+                reader, writer = await asyncio.open_connection(host, port)
+            except OSError:
+                if reconnect is None:
+                    raise
+                self.errors += 1
+            else:
+                try:
+                    if path is None:
+                        await self.feed(reader)
+                    else:
+                        await self.feed(reader, await _http_get(reader, writer, host, path))
+                except (OSError, ConnectionError, asyncio.IncompleteReadError):
+                    if reconnect is None:
+                        raise
+                    self.errors += 1
+                finally:
+                    writer.close()
+            if reconnect is None:
+                return
+            await asyncio.sleep(reconnect)
+
+    async def feed(self, reader, chunks=None):
+        #Reads one feed to its end: chunks of bytes from chunks, or straight
+        #from the stream reader
+        self.connections += 1
+        self.open_feeds += 1
+        self.peak_feeds = max(self.peak_feeds, self.open_feeds)
+        try:
+            if chunks is None:
+                chunks = _read_chunks(reader)
+            schema = None
+            line = 0
+            rest = b''
+            async for chunk in chunks:
+                chunk = rest + chunk
+                cut = chunk.rfind(b'\n') + 1
+                rest = chunk[cut:]
+                if cut:
+                    schema, line = await self._parse(chunk[:cut].decode(), schema, line)
+            if rest.strip():
+                await self._parse(rest.decode() + '\n', schema, line)
+        finally:
+            self.open_feeds -= 1
+
+    async def _parse(self, text, schema, line):
+        #Queues the tables parsed from whole lines of a feed that come after
+        #its first `line` lines; the first lines seen settle the feed's schema.
+        #Returns the schema and the number of lines read so far.
+        lines = text.splitlines(keepends=True)
+        offset = line
+        if schema is None:
+            schema, lines = split_header(lines)
+            offset += schema.header_lines
+        for table in parse_blocks(lines, schema, self.quarantine, offset):
+            await self.queue.put(table)
+        return schema, line + text.count('\n')
+
+    async def _consume(self):
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.flush_interval
+        while True:
+            try:
+                table = await asyncio.wait_for(self.queue.get(), max(deadline - loop.time(), 0))
+            except asyncio.TimeoutError:
+                self._flush()
+                deadline = loop.time() + self.flush_interval
+                continue
+            try:
+                self._hold(table)
+                if self.unflushed >= self.batch_size:
+                    self._flush()
+                    deadline = loop.time() + self.flush_interval
+            finally:
+                self.queue.task_done()
+
+    def _hold(self, table):
+        #A block of midnight rows alone looks daily, so each set of meters
+        #keeps the finest interval seen
+        interval = self.intervals[table.sites] = min(self.intervals.get(table.sites, DAY), table.interval)
+        pending = self.pending.get(table.sites)
+        if pending is None:
+            pending = self.pending[table.sites] = table
+        else:
+            pending.extend(table)
+        pending.interval = interval
+        self.pending_rows += len(table)
+        self.unflushed += len(table)
+        self.rows += len(table)
+
+    def _flush(self, final=False):
+        #Adds the pending rows to their summaries, in time order, keeping back
+        #the newest day of interval rows unless final
+        self.unflushed = 0
+        for sites, table in list(self.pending.items()):
+            if not table:
+                continue
+            stamps = table.timestamps()
+            table = table.take(sorted(range(len(table)), key=stamps.__getitem__))
+            held = EnergyTable(sites, table.interval)
+            if table.interval < DAY and not final:
+                cut = last_day_start(table)
+                table, held = table[:cut], table[cut:]
+            if table:
+                summary = self.summaries.get(sites)
+                if summary is None:
+                    summary = self.summaries[sites] = EnergySummary()
+                summary.update(table)
+            self.pending[sites] = held
+            self.pending_rows -= len(table)
+
+    @property
+    def summary(self):
+        #The summary of the one set of meters seen so far
+        if len(self.summaries) > 1:
+            raise ValueError(f'feeds for {len(self.summaries)} sets of meters; pick one from summaries')
+        return next(iter(self.summaries.values()), EnergySummary())
+
+    def snapshot(self, sites=None):
+        #A copy of a summary with the held back rows of the newest day added
+        if sites is None:
+            sites = next(iter(self.summaries.keys() | self.pending.keys()), ())
+        summary = self.summaries.get(tuple(sites))
+        summary = EnergySummary.from_dict(summary.to_dict()) if summary is not None else EnergySummary()
+        held = self.pending.get(tuple(sites))
+        if held:
+            stamps = held.timestamps()
+            summary.update(held.take(sorted(range(len(held)), key=stamps.__getitem__)))
+        return summary
+
+
+async def _read_chunks(reader):
+    while True:
+        chunk = await reader.read(READ_SIZE)
+        if not chunk:
+            return
+        yield chunk
+
+
+async def _http_get(reader, writer, host, path):
+    #Sends the request and reads the response head; returns the body's chunks
+    writer.write(f'GET {path} HTTP/1.1\r\nHost: {host}\r\nAccept: text/csv\r\n\r\n'.encode())
+    await writer.drain()
+    head = (await reader.readuntil(b'\r\n\r\n')).decode('latin-1').split('\r\n')
+    status = head[0].split(' ', 2)
+    if len(status) < 2 or status[1] != '200':
+        raise ConnectionError(f'feed {host}{path} answered {head[0]!r}')
+    headers = {name.strip().lower(): value.strip() for name, _, value in
+               (line.partition(':') for line in head[1:] if line)}
+    if headers.get('transfer-encoding', '').lower() == 'chunked':
+        return _read_chunked(reader)
+    return _read_chunks(reader)
+
+
+async def _read_chunked(reader):
+    while True:
+        size = int((await reader.readline()).split(b';')[0], 16)
+        if not size:
+            return
+        yield await reader.readexactly(size)
+        await reader.readexactly(2)
+
+
+async def stand_in_feed(lines, host='127.0.0.1', port=0, http=False, gate=None):
+    #A local stand-in for a gateway, for tests and load trials: every client
+    #that connects gets lines(n) for the n-th connection (or the same lines
+    #each time), raw or as a chunked HTTP response. With an asyncio.Event as
+    #gate, nothing is sent until it is set, so all clients can be connected at
+    #once first.
+    count = 0
+
+    async def send(reader, writer):
+        nonlocal count
+        body = lines(count) if callable(lines) else lines
+        count += 1
+        try:
+            if http:
+                await reader.readuntil(b'\r\n\r\n')
+                writer.write(b'HTTP/1.1 200 OK\r\nContent-Type: text/csv\r\nTransfer-Encoding: chunked\r\n\r\n')
+            if gate is not None:
+                await gate.wait()
+            for line in body:
+                data = line.encode()
+                writer.write(b'%x\r\n%s\r\n' % (len(data), data) if http else data)
+                await writer.drain()
+            if http:
+                writer.write(b'0\r\n\r\n')
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    return await asyncio.start_server(send, host, port, backlog=BACKLOG)
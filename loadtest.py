@@ -0,0 +1,134 @@
+#Load test for server.py: many clients at once, each sending its requests one
+#after another, with the latency of every request recorded.
+#
+#    python loadtest.py --clients 200 --requests 25
+#    python loadtest.py --url localhost:8000 --clients 500 --path /costs?rate=0.28
+#
+#Without --url a server is started in a child process for the run, so the
+#clients and the server don't share a GIL. Reports p50, p90 and p99 latency,
+#throughput and errors; every client opens a new connection per request.
+import argparse
+import http.client
+import json
+import math
+import os
+import subprocess
+import sys
+import threading
+import time
+
+PATHS = ['/production', '/seasonal', '/monthly', '/costs',
+         '/costs?rate=0.28&pge_rate=0.34', '/monthly?start=2025-01-01&end=2025-06-30']
+
+
+def percentile(ordered, q):
+    #Nearest-rank percentile of a sorted list, q from 0 to 100
+    if not ordered:
+        return None
+    return ordered[max(math.ceil(q / 100 * len(ordered)) - 1, 0)]
+
+
+def run_load(host, port, clients=200, requests=25, paths=PATHS, timeout=30.0):
+    latencies = []
+    errors = []
+    start = threading.Barrier(clients + 1)
+
+    def client(number):
+        mine = []
+        start.wait()
+        for n in range(requests):
+            path = paths[(number + n) % len(paths)]
+            began = time.perf_counter()
+            try:
+                connection = http.client.HTTPConnection(host, port, timeout=timeout)
+                connection.request('GET', path)
+                response = connection.getresponse()
+                response.read()
+                connection.close()
+                if response.status != 200:
+                    errors.append(f'{path}: HTTP {response.status}')
+            except OSError as error:
+                errors.append(f'{path}: {error}')
+                continue
+            mine.append(time.perf_counter() - began)
+        latencies.extend(mine)
+
+    threads = [threading.Thread(target=client, args=(number,), daemon=True) for number in range(clients)]
+    for thread in threads:
+        thread.start()
+    start.wait()
+    began = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    seconds = time.perf_counter() - began
+    latencies.sort()
+    return {
+        'clients': clients,
+        'requests': clients * requests,
+        'completed': len(latencies),
+        'errors': len(errors),
+        'first_errors': errors[:5],
+        'seconds': seconds,
+        'requests_per_second': len(latencies) / seconds if seconds else None,
+        'p50_ms': _ms(percentile(latencies, 50)),
+        'p90_ms': _ms(percentile(latencies, 90)),
+        'p99_ms': _ms(percentile(latencies, 99)),
+        'max_ms': _ms(latencies[-1] if latencies else None),
+    }
+
+
+def _ms(seconds):
+    return None if seconds is None else seconds * 1000
+
+
+def start_server(path=None, threads=None):
+    #Starts server.py on a free port in a child process; returns (process, port)
+    command = [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'server.py'), '--port', '0']
+    if path:
+        command.append(path)
+    if threads:
+        command += ['--threads', str(threads)]
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, text=True)
+    line = process.stdout.readline()
+    if not line.startswith('serving'):
+        process.kill()
+        raise RuntimeError(f'server did not start: {line!r}')
+    return process, int(line.rsplit(':', 1)[1])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Latency of server.py under many concurrent clients')
+    parser.add_argument('--url', help='host:port of a running server (default: start one)')
+    parser.add_argument('--data', help='export for the started server')
+    parser.add_argument('--threads', type=int, help='worker threads for the started server')
+    parser.add_argument('--clients', type=int, default=200)
+    parser.add_argument('--requests', type=int, default=25, help='requests per client')
+    parser.add_argument('--path', action='append', help='request path (repeatable; default: a mix of reports)')
+    parser.add_argument('--output', help='JSON file for the results')
+    args = parser.parse_args(argv)
+
+    process = None
+    if args.url:
+        host, _, port = args.url.removeprefix('http://').partition(':')
+        port = int(port or 80)
+    else:
+        process, port = start_server(args.data, args.threads)
+        host = '127.0.0.1'
+    try:
+        result = run_load(host, port, args.clients, args.requests, args.path or PATHS)
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+    print(f"{result['completed']}/{result['requests']} requests from {result['clients']} clients"
+          f" in {result['seconds']:.2f}s ({result['requests_per_second']:,.0f}/s), {result['errors']} errors")
+    if result['completed']:
+        print(f"latency p50 {result['p50_ms']:.1f} ms  p90 {result['p90_ms']:.1f} ms"
+              f"  p99 {result['p99_ms']:.1f} ms  max {result['max_ms']:.1f} ms")
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
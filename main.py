@@ -1,11 +1,139 @@
-from builddata import *
-from Analysis import *
-from CostSavings import *
+#Command line reports on an export.
+#
+#    python main.py production
+#    python main.py seasonal --by-site --percentiles
+#    python main.py monthly data.csv --start 2024-01-01 --end 2024-06-30 --format csv
+#    python main.py costs --rate 0.28 --pge-rate 0.34 --format json
+#    python main.py costs --tariff e-tou-c --profile
+#
+#Importing this module does no work, and a command imports only what it uses,
+#so calls from cron or a shell pipeline don't pay for reports they didn't ask
+#for. Start-up before any file is read is about the cost of the interpreter
+#plus argparse.
+import sys
 
+FORMATS = ('text', 'json', 'csv')
+#tariff.TARIFFS, named here so the parser doesn't import the tariff engine;
+#tests.py checks the two agree
+TARIFFS = ('e-tou-c',)
 
 
-# print(production_analysis(get_data()))
-# print(seasonal_analysis(get_data()))
-# print(monthly_analysis(get_data()))
+def build_parser():
+    import argparse
+    parser = argparse.ArgumentParser(prog='main.py', description='Solar production and savings reports')
+    commands = parser.add_subparsers(dest='command', required=True, metavar='command')
+    for name, text in (('production', 'totals, daily average, best and worst day'),
+                       ('seasonal', 'production by season'),
+                       ('monthly', 'production by month'),
+                       ('costs', 'savings against California and PG&E rates')):
+        command = commands.add_parser(name, help=text, description=text)
+        command.add_argument('path', nargs='?', help='CSV export (default: the Cal Poly export)')
+        command.add_argument('--start', help='first day to include, YYYY-MM-DD')
+        command.add_argument('--end', help='last day to include, YYYY-MM-DD')
+        command.add_argument('--format', choices=FORMATS, default='text')
+        command.add_argument('--by-site', action='store_true', help='split results by site')
+        command.add_argument('--no-cache', action='store_true', help='parse the CSV even if a cached copy is current')
+        command.add_argument('--profile', action='store_true', help='print stage timings to stderr')
+        if name in ('seasonal', 'monthly'):
+            command.add_argument('--percentiles', action='store_true', help='add 5th/50th/95th percentile days')
+        if name == 'costs':
+            command.add_argument('--rate', type=float, help='value of solar kWh, $ (default 0.30)')
+            command.add_argument('--pge-rate', type=float, help='flat PG&E rate, $ (default 0.32)')
+            command.add_argument('--tariff', choices=TARIFFS, help='price PG&E and the monthly breakdown by time of use instead')
+    return parser
 
-print(comprehensive_cost_analysis(get_data()),0.3,0.32)
\ No newline at end of file
+
+def load(args):
+    from builddata import DATA_FILE, get_data
+    table = get_data(args.path or DATA_FILE, cache=not args.no_cache)
+    if args.start or args.end:
+        table = table.window(args.start, args.end)
+    return table
+
+
+def run(args):
+    #The report asked for, as the dict the report function returns, or None
+    #if there are no readings to report on
+    data = load(args)
+    if not data:
+        return None
+    if args.command == 'production':
+        from Analysis import production_analysis
+        return production_analysis(data)
+    if args.command == 'seasonal':
+        from Analysis import seasonal_analysis
+        return seasonal_analysis(data, args.by_site, args.percentiles)
+    if args.command == 'monthly':
+        from Analysis import monthly_analysis
+        return monthly_analysis(data, args.by_site, args.percentiles)
+    import CostSavings
+    tariff = None
+    if args.tariff:
+        from tariff import TARIFFS as tariffs
+        tariff = tariffs[args.tariff]
+    return CostSavings.comprehensive_cost_analysis(
+        data,
+        CostSavings.CA_AVG_RATE if args.rate is None else args.rate,
+        CostSavings.PGE_SLO_RATE if args.pge_rate is None else args.pge_rate,
+        args.by_site, tariff)
+
+
+def flatten(result, prefix=''):
+    #(dotted key, value) for every leaf of a nested report
+    if isinstance(result, dict):
+        for key, value in result.items():
+            yield from flatten(value, f'{prefix}{key}.')
+    else:
+        yield prefix[:-1], result
+
+
+def _plain(value):
+    #Report values JSON can't hold (dates, Energy rows) as text
+    return value if isinstance(value, (int, float, str, bool, type(None))) else str(value)
+
+
+def render(result, format='text'):
+    if format == 'json':
+        import json
+        return json.dumps(result, indent=2, default=_plain)
+    if format == 'csv':
+        import csv
+        import io
+        out = io.StringIO()
+        writer = csv.writer(out, lineterminator='\n')
+        writer.writerow(('key', 'value'))
+        writer.writerows((key, _plain(value)) for key, value in flatten(result))
+        return out.getvalue().rstrip('\n')
+    lines = []
+    for key, value in flatten(result):
+        lines.append(f'{key}: {value:,.2f}' if isinstance(value, float) else f'{key}: {_plain(value)}')
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.profile:
+        import profiling
+        profiling.enable()
+    try:
+        result = run(args)
+    except (OSError, ValueError) as error:
+        print(f'main.py {args.command}: {error}', file=sys.stderr)
+        return 1
+    if not result:
+        print(f'main.py {args.command}: no readings in range', file=sys.stderr)
+        return 1
+    try:
+        print(render(result, args.format))
+        sys.stdout.flush()
+    except BrokenPipeError:
+        #The reader (head, grep -m) stopped early; don't traceback at exit
+        sys.stdout = None
+        return 1
+    if args.profile:
+        print(profiling.summary_table(), file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
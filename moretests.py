@@ -282,5 +282,123 @@ class TestCostSavingsRealData(unittest.TestCase):
 
 
 
+class TestRateScenarios(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.real_data = get_data()
+
+    def test_scenarios_match_single_rate_reports(self):
+        from CostSavings import rate_scenarios
+        ca_rates = [0.20, 0.30, 0.35]
+        pge_rates = [0.25, 0.32, 0.40]
+        result = rate_scenarios(self.real_data, ca_rates, pge_rates)
+        self.assertEqual(result['scenarios'], 3)
+        for i, (ca, pge) in enumerate(zip(ca_rates, pge_rates)):
+            single = pge_comparison(self.real_data, solar_rate=ca, pge_rate=pge)
+            self.assertAlmostEqual(result['total_savings'][i], single['solar_value'], places=4)
+            self.assertAlmostEqual(result['projected_annual_savings_vs_pge'][i],
+                                   single['projected_annual_savings_vs_pge'], places=4)
+            self.assertAlmostEqual(result['percent_saved_vs_pge'][i], single['percent_saved_vs_pge'], places=6)
+            monthly = monthly_savings_breakdown(self.real_data, rate_per_kwh=ca)
+            for month, stats in monthly.items():
+                self.assertAlmostEqual(result['monthly_savings'][month][i], stats['total_savings'], places=4)
+
+    def test_escalation_and_large_sweep(self):
+        # How long the sweep takes is measured by benchmark.py, not here
+        from CostSavings import rate_scenarios
+        rates = [0.20 + i * 0.00002 for i in range(10_000)]
+        result = rate_scenarios(self.real_data, rates, 0.32, escalation=0.03, years=10)
+        self.assertEqual(len(result['multi_year_savings']), 10_000)
+        factor = sum(1.03 ** year for year in range(10))
+        self.assertAlmostEqual(result['multi_year_savings'][0],
+                               result['projected_annual_savings'][0] * factor, places=4)
+        with self.assertRaises(ValueError):
+            rate_scenarios(self.real_data, [0.3, 0.31], [0.32, 0.33, 0.34])
+
+
+class TestTouTariff(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.real_data = get_data()
+
+    def hourly_table(self):
+        import io
+        from builddata import iter_data, as_table
+        header = 'Timestamp,Cal Poly Gold Tree Solar (C) Total Meter Energy,Cal Poly Student Housing Solar Total Meter Energy,,\n'
+        # Friday 2024-07-05 and Saturday 2024-07-06, one reading an hour
+        lines = [f'2024-07-{day:02d} {hour:02d}:00:00 PDT,1kWh,1kWh,{hour + 1},1\n'
+                 for day in (5, 6) for hour in range(24)]
+        return as_table(iter_data(io.StringIO(header + ''.join(lines))))
+
+    def test_lookup_matches_schedule(self):
+        from tariff import TouTariff, WEEKENDS
+        tariff = TouTariff('test', [(range(1, 13), range(24), 0.10),
+                                    ([7], range(16, 21), 0.50),
+                                    ([7], range(16, 21), 0.20, WEEKENDS)])
+        table = self.hourly_table()
+        self.assertEqual(table.interval, 3600)
+        rates = tariff.row_rates(table)
+        for row, rate in zip(table, rates):
+            peak = 16 <= row.hour < 21
+            expected = (0.20 if row.day == 6 else 0.50) if peak else 0.10
+            self.assertEqual(rate, expected)
+        self.assertAlmostEqual(tariff.table_cost(table),
+                               sum(row.total * rate for row, rate in zip(table, rates)))
+        # The summary's profile prices the same as the rows
+        self.assertAlmostEqual(tariff.cost(table), tariff.table_cost(table))
+
+    def test_plugs_into_cost_reports(self):
+        from summary import WHOLE_DAY
+        from tariff import E_TOU_C, TouTariff
+        flat = TouTariff('flat', [(range(1, 13), range(24), 0.32)])
+        self.assertAlmostEqual(pge_comparison(self.real_data, tariff=flat)['pge_rate'], 0.32)
+        result = pge_comparison(self.real_data, tariff=E_TOU_C)
+        self.assertEqual(result['pge_tariff'], 'PG&E E-TOU-C')
+        self.assertAlmostEqual(result['pge_cost_equivalent'], E_TOU_C.cost(self.real_data), places=4)
+        monthly = monthly_savings_breakdown(self.real_data, tariff=E_TOU_C, by_site=True)
+        july = monthly['2024-July']
+        # Daily rows are priced at the average rate over daylight hours
+        self.assertAlmostEqual(july['effective_rate'], E_TOU_C.rate(7, WHOLE_DAY))
+        self.assertAlmostEqual(july['effective_rate'], (9 * 0.43 + 3 * 0.49) / 12)
+        self.assertAlmostEqual(july['sites']['goldtree']['total_savings'] + july['sites']['housing']['total_savings'],
+                               july['total_savings'], places=4)
+        self.assertLess(monthly['2024-December']['effective_rate'], july['effective_rate'])
+        # The combined report prices its monthly breakdown by the tariff too
+        combined = comprehensive_cost_analysis(self.real_data, by_site=True, tariff=E_TOU_C)
+        self.assertEqual(combined['monthly_breakdown'], monthly)
+        self.assertEqual(combined['pge_comparison'], result)
+
+
+class TestSimulatedProjection(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.real_data = get_data()
+
+    def test_bands_follow_the_seasons(self):
+        # How long the simulations take is measured by benchmark.py, not here
+        from CostSavings import DAYS_IN_MONTH, simulated_projection
+        from summary import summarize
+        result = simulated_projection(self.real_data, simulations=10_000, seed=42)
+        band = result['annual_kwh']
+        self.assertLess(band['low'], band['median'])
+        self.assertLess(band['median'], band['high'])
+        # Each calendar month weighted by its length, not by how often it
+        # happens to appear in the export
+        totals, days = [0.0] * 12, [0] * 12
+        for (year, month), group in summarize(self.real_data).months.items():
+            totals[month - 1] += group.total.value
+            days[month - 1] += group.days
+        expected = sum(n * total / count for n, total, count in zip(DAYS_IN_MONTH, totals, days))
+        self.assertAlmostEqual(band['mean'] / expected, 1.0, places=2)
+        self.assertAlmostEqual(result['annual_savings']['high'], band['high'] * 0.30)
+        self.assertEqual(simulated_projection(self.real_data, simulations=500, seed=1),
+                         simulated_projection(self.real_data, simulations=500, seed=1))
+        with self.assertRaises(ValueError):
+            simulated_projection(self.real_data[:10])
+
+
 if __name__ == '__main__':
     unittest.main(verbosity=2)
\ No newline at end of file
@@ -0,0 +1,175 @@
+#Opt-in timing of the pipeline's stages. Parsing, every report in Analysis.py
+#and every cost function are wrapped with @profiled; while profiling is off
+#the wrapper is one flag check and a plain call.
+#
+#    import profiling
+#    profiling.enable()                    # or run with ENERGY_PROFILE=1
+#    comprehensive_cost_analysis(get_data())
+#    print(profiling.summary_table())
+#    profiling.save('profile.json')
+#
+#Each stage records wall time, rows processed, rows per second and its peak
+#traced allocation (tracemalloc, started on enable()). Stages nest: a parent's
+#peak covers its children.
+import functools
+import json
+import os
+import threading
+import time
+
+enabled = False
+records = []
+_started_tracing = False
+tracemalloc = None
+_local = threading.local()
+
+
+def enable(memory=True):
+    #tracemalloc is only imported here, keeping start-up cheap while disabled
+    global enabled, _started_tracing, tracemalloc
+    import tracemalloc
+    enabled = True
+    if memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+        _started_tracing = True
+
+
+def disable():
+    #Stops tracemalloc only if enable() started it
+    global enabled, _started_tracing
+    enabled = False
+    if _started_tracing:
+        tracemalloc.stop()
+        _started_tracing = False
+
+
+def reset():
+    records.clear()
+
+
+def rows_of(data):
+    #Rows behind a report's input: a table or list's length, a summary's days
+    if hasattr(data, 'days') and not callable(data.days):
+        return data.days
+    try:
+        return len(data)
+    except TypeError:
+        return None
+
+
+class _Stage:
+    __slots__ = ('name', 'rows', 'start', 'base', 'outer_peak', 'child_peak')
+
+    def __init__(self, name, rows):
+        self.name = name
+        self.rows = rows
+
+    def __enter__(self):
+        stack = getattr(_local, 'stack', None)
+        if stack is None:
+            stack = _local.stack = []
+        self.child_peak = 0
+        if tracemalloc and tracemalloc.is_tracing():
+            self.base, self.outer_peak = tracemalloc.get_traced_memory()
+            tracemalloc.reset_peak()
+        else:
+            self.base = self.outer_peak = None
+        stack.append(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        seconds = time.perf_counter() - self.start
+        _local.stack.pop()
+        peak = None
+        if self.base is not None and tracemalloc and tracemalloc.is_tracing():
+            absolute = max(tracemalloc.get_traced_memory()[1], self.child_peak)
+            peak = absolute - self.base
+            #tracemalloc only has one peak, so hand the enclosing stage the
+            #highest point it would have seen
+            if _local.stack:
+                parent = _local.stack[-1]
+                parent.child_peak = max(parent.child_peak, absolute, self.outer_peak)
+        records.append({
+            'stage': self.name,
+            'seconds': seconds,
+            'rows': self.rows,
+            'rows_per_second': self.rows / seconds if self.rows and seconds else None,
+            'peak_bytes': peak,
+        })
+        return False
+
+
+class _Off:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_OFF = _Off()
+
+
+def stage(name, rows=None):
+    #Context manager timing the block as one stage; rows is how many rows it
+    #worked through, if known
+    return _Stage(name, rows) if enabled else _OFF
+
+
+def profiled(name=None, rows=rows_of, arg=0):
+    #Decorator recording every call as a stage; rows is worked out from
+    #positional argument `arg` (1 for methods), or from the result when
+    #rows='result'
+    def decorate(function):
+        label = name or function.__name__
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not enabled:
+                return function(*args, **kwargs)
+            with _Stage(label, rows(args[arg]) if len(args) > arg and callable(rows) else None) as record:
+                result = function(*args, **kwargs)
+                if rows == 'result':
+                    record.rows = rows_of(result)
+                return result
+        return wrapper
+    return decorate
+
+
+def summary():
+    #Records totalled per stage name: calls, seconds, rows, rows/s, peak
+    totals = {}
+    for record in records:
+        total = totals.setdefault(record['stage'], {
+            'stage': record['stage'], 'calls': 0, 'seconds': 0.0, 'rows': 0, 'peak_bytes': None})
+        total['calls'] += 1
+        total['seconds'] += record['seconds']
+        total['rows'] += record['rows'] or 0
+        if record['peak_bytes'] is not None:
+            total['peak_bytes'] = max(total['peak_bytes'] or 0, record['peak_bytes'])
+    for total in totals.values():
+        total['rows_per_second'] = total['rows'] / total['seconds'] if total['rows'] and total['seconds'] else None
+    return list(totals.values())
+
+
+def summary_table():
+    lines = [f"{'stage':<32} {'calls':>6} {'seconds':>10} {'rows':>10} {'rows/s':>12} {'peak MiB':>9}"]
+    for total in summary():
+        rate = f"{total['rows_per_second']:12,.0f}" if total['rows_per_second'] else f"{'':>12}"
+        peak = f"{total['peak_bytes'] / 2**20:9.2f}" if total['peak_bytes'] is not None else f"{'':>9}"
+        lines.append(f"{total['stage']:<32} {total['calls']:>6} {total['seconds']:10.4f} {total['rows']:>10} {rate} {peak}")
+    return '\n'.join(lines)
+
+
+def to_json():
+    return json.dumps({'stages': summary(), 'records': records}, indent=2)
+
+
+def save(path):
+    with open(path, 'w') as f:
+        f.write(to_json())
+
+
+if os.environ.get('ENERGY_PROFILE'):
+    enable()
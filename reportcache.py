@@ -0,0 +1,148 @@
+#In-memory cache of report results, so asking for the same report on the same
+#data again is a dictionary lookup instead of another pass over the summary.
+#
+#    production_analysis(table)             # computed
+#    production_analysis(table)             # from the cache
+#    table.append(...)                      # new rows: the old results no
+#    production_analysis(table)             # longer match, so computed again
+#    CACHE.stats()                          # {'hits': 1, 'misses': 2, ...}
+#
+#Results are keyed by the report, a fingerprint of its EnergyTable and the
+#call's other arguments with defaults filled in, so f(table) and
+#f(table, CA_AVG_RATE) share an entry. The fingerprint is a hash of the
+#table's column bytes, kept on the table until rows are added or a column is
+#replaced, so two loads of the same export share results too. Other inputs (a
+#summary, a store, a list of records) may change without the cache seeing it
+#and are never cached. Each hit hands back a deep copy, so callers may change
+#what they get.
+import copy
+import functools
+import hashlib
+import threading
+from collections import OrderedDict
+
+from builddata import EnergyTable
+
+MAX_ENTRIES = 256
+_MISSING = object()
+
+
+def fingerprint(table):
+    #Digest of the table's sites, interval and columns, recomputed only when
+    #its length or any column array changes
+    state = (len(table), table.interval, tuple(id(column) for name, column in table.columns()))
+    cached = table._fingerprint
+    if cached is not None and cached[0] == state:
+        return cached[1]
+    digest = hashlib.blake2b(repr((table.sites, table.interval)).encode(), digest_size=16)
+    for name, column in table.columns():
+        digest.update(column)
+    table._fingerprint = (state, digest.hexdigest())
+    return table._fingerprint[1]
+
+
+def _freeze(value):
+    #Hashable stand-in for an argument; lists and dicts become tuples
+    if isinstance(value, (list, tuple)):
+        return tuple(map(_freeze, value))
+    if isinstance(value, dict):
+        return tuple(sorted((key, _freeze(item)) for key, item in value.items()))
+    hash(value)
+    return value
+
+
+class ReportCache:
+    #LRU of report results, at most maxsize of them; maxsize 0 turns caching off
+
+    def __init__(self, maxsize=MAX_ENTRIES):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key, default=None):
+        with self.lock:
+            try:
+                result = self.entries[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return result
+
+    def put(self, key, result):
+        with self.lock:
+            self.entries[key] = result
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.hits = self.misses = self.evictions = 0
+
+    def stats(self):
+        calls = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'entries': len(self.entries),
+            'maxsize': self.maxsize,
+            'hit_rate': self.hits / calls if calls else None,
+        }
+
+
+CACHE = ReportCache()
+
+
+def _binder(function):
+    #Maps a call's arguments, after the data, to every parameter's value with
+    #defaults filled in, like inspect.signature().bind() at a fraction of the
+    #import and call cost. Raises TypeError for a call that doesn't fit.
+    code = function.__code__
+    names = code.co_varnames[:code.co_argcount + code.co_kwonlyargcount]
+    defaults = dict(zip(names[code.co_argcount - len(function.__defaults__ or ()):], function.__defaults__ or ()))
+    defaults.update(function.__kwdefaults__ or {})
+    positional = code.co_argcount
+
+    def bind(args, kwargs):
+        if len(args) > positional or not kwargs.keys() <= set(names[len(args):]):
+            raise TypeError
+        values = dict(defaults)
+        values.update(zip(names, args))
+        values.update(kwargs)
+        return tuple(values[name] for name in names[1:])
+    return bind
+
+
+def memoized(function=None, cache=None):
+    #Decorator caching a report whose first argument is its data
+    if function is None:
+        return functools.partial(memoized, cache=cache)
+    name = function.__module__ + '.' + function.__qualname__
+    bind = _binder(function)
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        store = CACHE if cache is None else cache
+        if not store.maxsize or not args or not isinstance(args[0], EnergyTable):
+            return function(*args, **kwargs)
+        try:
+            key = (name, fingerprint(args[0]), _freeze(bind(args, kwargs)))
+        except (TypeError, KeyError):
+            return function(*args, **kwargs)
+        result = store.get(key, _MISSING)
+        if result is _MISSING:
+            result = function(*args, **kwargs)
+            store.put(key, result)
+        return copy.deepcopy(result)
+    return wrapper
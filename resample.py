@@ -0,0 +1,68 @@
+#Rolls interval readings (15 minute, hourly) up to hourly, daily or monthly
+#rows. Rows are put in time order once, each row gets the key of the period it
+#falls in, and the period boundaries are the places the key changes, found
+#with one compress() over the key column; each period is then summed with
+#fsum over a slice of every reading column. No per-interval objects are built.
+#
+#    daily = resample(get_data('meter_15min.csv'), 'day')
+from array import array
+from itertools import compress, repeat
+from math import fsum
+from operator import add, floordiv, le, mul, ne
+
+from builddata import DAY, HOUR, EnergyTable
+
+#Average Gregorian month, used as the interval of monthly tables
+MONTH = 2629746
+FREQUENCIES = {'hour': HOUR, 'day': DAY, 'month': MONTH}
+
+
+def period_keys(table, freq, stamps):
+    #Key of the period each row belongs to. Hours follow UTC, so the repeated
+    #1am when PDT ends stays two separate hours; days and months follow the
+    #local calendar dates in the file.
+    n = len(table)
+    if freq == 'hour':
+        return array('q', map(floordiv, stamps, repeat(HOUR, n)))
+    if freq == 'day':
+        return array('l', map(add, map(mul, table.year, repeat(10000, n)),
+                              map(add, map(mul, table.month, repeat(100, n)), table.day)))
+    return array('l', map(add, map(mul, table.year, repeat(12, n)), table.month))
+
+
+def boundaries(keys):
+    #(starts, stops) of the runs of equal keys
+    n = len(keys)
+    if n == 0:
+        return [], []
+    starts = [0]
+    starts.extend(compress(range(1, n), map(ne, keys[1:], keys)))
+    return starts, starts[1:] + [n]
+
+
+def resample(table, freq):
+    #New EnergyTable with one row per hour, day or month, each holding the sum
+    #of the readings in that period and dated by its first reading. A table
+    #that is already that coarse comes back as it is.
+    interval = FREQUENCIES[freq]
+    if table.interval >= interval:
+        return table
+    stamps = table.timestamps()
+    if not all(map(le, stamps, stamps[1:])):
+        order = sorted(range(len(stamps)), key=stamps.__getitem__)
+        table = table.take(order)
+        stamps = array('q', map(stamps.__getitem__, order))
+    starts, stops = boundaries(period_keys(table, freq, stamps))
+    n = len(starts)
+    result = EnergyTable(table.sites, interval)
+    for name in EnergyTable.DATE_COLUMNS:
+        column = getattr(table, name)
+        setattr(result, name, array(column.typecode, map(column.__getitem__, starts)))
+    result.minute = array('B', bytes(n))
+    if freq != 'hour':
+        result.hour = array('B', bytes(n))
+    if freq == 'month':
+        result.day = array('B', repeat(1, n))
+    for site, column in table.readings.items():
+        result.readings[site] = array('d', map(fsum, map(column.__getitem__, map(slice, starts, stops))))
+    return result
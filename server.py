@@ -0,0 +1,205 @@
+#HTTP report service: loads an export once and answers report requests from
+#memory, standard library only.
+#
+#    python server.py --port 8000 [export.csv]
+#    curl 'localhost:8000/production'
+#    curl 'localhost:8000/seasonal?by_site=1&percentiles=1'
+#    curl 'localhost:8000/monthly?start=2025-01-01&end=2025-06-30'
+#    curl 'localhost:8000/costs?rate=0.28&pge_rate=0.34&tariff=e-tou-c'
+#
+#Every endpoint returns the JSON of the matching report function. The default
+#view of each one is computed and serialized at start-up, so it is answered
+#with a dict lookup; other parameter combinations are serialized on first use
+#and kept in an LRU (see reportcache.ReportCache). Requests are handled by a
+#fixed pool of threads rather than a thread per connection, so a burst of
+#clients queues instead of starting hundreds of threads. loadtest.py measures
+#the latency.
+import argparse
+import json
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import Analysis
+import CostSavings
+from builddata import DATA_FILE, get_data
+from reportcache import ReportCache
+from tariff import TARIFFS
+
+THREADS = 16
+RESPONSE_CACHE_SIZE = 512
+FLAGS = {'1': True, 'true': True, 'yes': True, '0': False, 'false': False, 'no': False}
+
+
+class BadRequest(ValueError):
+    pass
+
+
+def _flag(value):
+    try:
+        return FLAGS[value.lower()]
+    except KeyError:
+        raise BadRequest(f'expected true or false, got {value!r}') from None
+
+
+def _rate(value):
+    try:
+        rate = float(value)
+    except ValueError:
+        raise BadRequest(f'expected a rate in $/kWh, got {value!r}') from None
+    if not 0 <= rate < 100:
+        raise BadRequest(f'rate {rate} is out of range')
+    return rate
+
+
+def _tariff(value):
+    try:
+        return TARIFFS[value]
+    except KeyError:
+        raise BadRequest(f'unknown tariff {value!r}, expected one of {sorted(TARIFFS)}') from None
+
+
+#Parameters each endpoint takes besides start and end, with how to read them
+PARAMETERS = {
+    'production': {},
+    'seasonal': {'by_site': _flag, 'percentiles': _flag},
+    'monthly': {'by_site': _flag, 'percentiles': _flag},
+    'costs': {'by_site': _flag, 'rate': _rate, 'pge_rate': _rate, 'tariff': _tariff},
+}
+
+
+class Reports:
+    #The loaded table and the serialized responses; safe to share between
+    #the server's threads
+
+    def __init__(self, data, cache_size=RESPONSE_CACHE_SIZE):
+        self.data = data
+        #Built now, so no request thread builds them while another reads them
+        data.summary
+        data.index
+        self.cache = ReportCache(cache_size)
+        self.defaults = {endpoint: self.render(endpoint, {}) for endpoint in PARAMETERS}
+
+    def render(self, endpoint, params):
+        #(status, JSON bytes) for an endpoint and its query parameters
+        if endpoint not in PARAMETERS:
+            return 404, _json({'error': f'no endpoint /{endpoint}', 'endpoints': sorted(PARAMETERS)})
+        allowed = PARAMETERS[endpoint]
+        unknown = params.keys() - allowed.keys() - {'start', 'end'}
+        if unknown:
+            return 400, _json({'error': f'unknown parameters {sorted(unknown)}',
+                               'parameters': sorted(allowed) + ['end', 'start']})
+        try:
+            options = {name: allowed[name](value) for name, value in params.items() if name in allowed}
+            data = self.data
+            if 'start' in params or 'end' in params:
+                try:
+                    data = data.window(params.get('start'), params.get('end'))
+                except ValueError:
+                    raise BadRequest('start and end are dates, YYYY-MM-DD') from None
+        except BadRequest as error:
+            return 400, _json({'error': str(error)})
+        if not data:
+            return 404, _json({'error': 'no readings in range'})
+        return 200, _json(self.report(endpoint, data, options))
+
+    def report(self, endpoint, data, options):
+        if endpoint == 'production':
+            return Analysis.production_analysis(data)
+        if endpoint == 'seasonal':
+            return Analysis.seasonal_analysis(data, options.get('by_site', False), options.get('percentiles', False))
+        if endpoint == 'monthly':
+            return Analysis.monthly_analysis(data, options.get('by_site', False), options.get('percentiles', False))
+        return CostSavings.comprehensive_cost_analysis(
+            data, options.get('rate', CostSavings.CA_AVG_RATE), options.get('pge_rate', CostSavings.PGE_SLO_RATE),
+            options.get('by_site', False), options.get('tariff'))
+
+    def respond(self, target):
+        #(status, JSON bytes) for a request target such as '/costs?rate=0.3'
+        url = urlsplit(target)
+        endpoint = url.path.strip('/')
+        if not url.query and endpoint in self.defaults:
+            return self.defaults[endpoint]
+        query = parse_qs(url.query, keep_blank_values=True)
+        if any(len(values) > 1 for values in query.values()):
+            return 400, _json({'error': 'each parameter may be given once'})
+        params = {name: values[0] for name, values in query.items()}
+        key = (endpoint, tuple(sorted(params.items())))
+        response = self.cache.get(key)
+        if response is None:
+            response = self.render(endpoint, params)
+            #Errors are cheap to work out again, so only answers are kept
+            if response[0] == 200:
+                self.cache.put(key, response)
+        return response
+
+
+def _json(result):
+    return json.dumps(result, default=str).encode()
+
+
+class ReportHandler(BaseHTTPRequestHandler):
+    server_version = 'EnergyReports/1.0'
+
+    def do_GET(self):
+        if self.path.rstrip('/') == '/health':
+            status, body = 200, b'{"status": "ok"}'
+        else:
+            status, body = self.server.reports.respond(self.path)
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        if not self.server.quiet:
+            super().log_message(format, *args)
+
+
+class ReportServer(HTTPServer):
+    #HTTPServer handing each connection to a fixed ThreadPoolExecutor
+    request_queue_size = 1024
+
+    def __init__(self, address, reports, threads=THREADS, quiet=True):
+        self.reports = reports
+        self.quiet = quiet
+        self.pool = ThreadPoolExecutor(threads, thread_name_prefix='report')
+        super().__init__(address, ReportHandler)
+
+    def process_request(self, request, client_address):
+        self.pool.submit(self._process, request, client_address)
+
+    def _process(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def server_close(self):
+        super().server_close()
+        self.pool.shutdown(wait=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Serve solar production and savings reports over HTTP')
+    parser.add_argument('path', nargs='?', default=DATA_FILE, help='CSV export (default: the Cal Poly export)')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--threads', type=int, default=THREADS)
+    parser.add_argument('--log', action='store_true', help='log every request to stderr')
+    args = parser.parse_args(argv)
+    server = ReportServer((args.host, args.port), Reports(get_data(args.path)), args.threads, quiet=not args.log)
+    print(f'serving {args.path} on http://{server.server_address[0]}:{server.server_address[1]}', flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
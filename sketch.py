@@ -0,0 +1,100 @@
+#Approximate quantiles in a few KB, whatever the number of readings. Values
+#are counted in buckets whose edges grow geometrically by gamma, so every
+#quantile comes back within `accuracy` (relative) of a true value in the data.
+#Two sketches with the same accuracy merge by adding their bucket counts: the
+#result is exactly the sketch of all the values together, in any order or
+#grouping, so sketches can be built per file or per process and combined.
+from collections import Counter
+from itertools import repeat
+from math import ceil, log
+from operator import mul
+
+ACCURACY = 0.01
+MAX_BUCKETS = 2048
+
+
+class QuantileSketch:
+    #Bucket k holds values in (gamma ** (k - 1), gamma ** k]. Values of 0 or
+    #less are counted separately and read back as 0. When more than max_buckets
+    #are in use the lowest ones are folded together, which only costs accuracy
+    #at the very bottom of the distribution.
+    __slots__ = ('accuracy', 'gamma', 'scale', 'buckets', 'zeros', 'count', 'max_buckets')
+
+    def __init__(self, accuracy=ACCURACY, max_buckets=MAX_BUCKETS):
+        self.accuracy = accuracy
+        self.gamma = (1 + accuracy) / (1 - accuracy)
+        self.scale = 1 / log(self.gamma)
+        self.buckets = Counter()
+        self.zeros = 0
+        self.count = 0
+        self.max_buckets = max_buckets
+
+    def __len__(self):
+        return self.count
+
+    def add(self, values):
+        #Adds a sequence of values; the bucket keys are worked out with map()
+        #and counted by Counter in C
+        n = len(values)
+        positive = [value for value in values if value > 0] if min(values, default=1) <= 0 else values
+        self.zeros += n - len(positive)
+        self.buckets.update(map(ceil, map(mul, map(log, positive), repeat(self.scale, len(positive)))))
+        self.count += n
+        self._collapse()
+
+    def merge(self, other):
+        if other.accuracy != self.accuracy:
+            raise ValueError('sketches with different accuracy cannot be merged')
+        self.buckets.update(other.buckets)
+        self.zeros += other.zeros
+        self.count += other.count
+        self._collapse()
+        return self
+
+    def _collapse(self):
+        if len(self.buckets) <= self.max_buckets:
+            return
+        keys = sorted(self.buckets)
+        extra = len(keys) - self.max_buckets
+        floor = keys[extra]
+        self.buckets[floor] += sum(self.buckets.pop(key) for key in keys[:extra])
+
+    def quantile(self, q):
+        #Value at quantile q (0 to 1), or None for an empty sketch
+        if not self.count:
+            return None
+        rank = q * (self.count - 1)
+        seen = self.zeros
+        if rank < seen:
+            return 0.0
+        for key in sorted(self.buckets):
+            seen += self.buckets[key]
+            if rank < seen:
+                return 2 * self.gamma ** key / (self.gamma + 1)
+        return 2 * self.gamma ** max(self.buckets) / (self.gamma + 1)
+
+    def values(self):
+        #The counted values as a list, each read back as its bucket's value,
+        #for drawing samples from the distribution
+        result = [0.0] * self.zeros
+        for key in sorted(self.buckets):
+            result.extend([2 * self.gamma ** key / (self.gamma + 1)] * self.buckets[key])
+        return result
+
+    def quantiles(self, qs):
+        return [self.quantile(q) for q in qs]
+
+    def to_dict(self):
+        return {
+            'accuracy': self.accuracy,
+            'zeros': self.zeros,
+            'buckets': sorted(self.buckets.items()),
+        }
+
+    @classmethod
+    def from_dict(cls, state):
+        sketch = cls(state['accuracy'])
+        sketch.buckets = Counter(dict(map(tuple, state['buckets'])))
+        sketch.zeros = state['zeros']
+        sketch.count = sketch.zeros + sum(sketch.buckets.values())
+        return sketch
@@ -0,0 +1,171 @@
+#SQLite-backed store for readings from any number of exports. Readings are
+#kept one per (site, timestamp), so loading overlapping exports upserts rather
+#than duplicates, and several report processes can share one indexed database
+#instead of each parsing the CSVs.
+#
+#    store = EnergyStore('energy.db')
+#    store.load('Solar data cal poly csv.csv')
+#    monthly_analysis(store)                    # or seasonal_analysis, costs...
+#
+#Reports see the store through its summary: the readings are added up to one
+#row per day and site in SQL, so only days ever come back to Python, however
+#fine the stored intervals are.
+import sqlite3
+from array import array
+from itertools import repeat
+
+from builddata import BATCH_SIZE, EnergyTable, guess_interval, iter_batches, iter_data, to_date
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS readings (
+    site TEXT NOT NULL,
+    ts INTEGER NOT NULL,
+    year INTEGER NOT NULL,
+    month INTEGER NOT NULL,
+    day INTEGER NOT NULL,
+    hour INTEGER NOT NULL,
+    minute INTEGER NOT NULL,
+    utc_offset INTEGER NOT NULL,
+    kwh REAL NOT NULL,
+    PRIMARY KEY (site, ts)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS readings_date ON readings (year, month, day);
+CREATE INDEX IF NOT EXISTS readings_month ON readings (month);
+'''
+
+UPSERT = '''
+INSERT INTO readings (site, ts, year, month, day, hour, minute, utc_offset, kwh)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (site, ts) DO UPDATE SET kwh = excluded.kwh
+'''
+
+
+class EnergyStore:
+
+    def __init__(self, path=':memory:', timeout=30.0):
+        self.path = path
+        self.connection = sqlite3.connect(path, timeout=timeout)
+        if path != ':memory:':
+            #Readers keep reading while another process writes
+            self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.executescript(SCHEMA)
+        self.connection.commit()
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return self.connection.execute('SELECT COUNT(*) FROM readings').fetchone()[0]
+
+    def upsert(self, data, batch_size=BATCH_SIZE):
+        #Writes an EnergyTable or a stream of records or batches, batch_size
+        #rows per transaction; a reading already stored for the same site and
+        #timestamp is replaced. Returns the number of rows written.
+        written = 0
+        for table in iter_batches(data, batch_size):
+            for start in range(0, len(table), batch_size):
+                part = table[start:start + batch_size]
+                stamps = part.timestamps()
+                with self.connection:
+                    for site, column in part.readings.items():
+                        self.connection.executemany(UPSERT, zip(
+                            repeat(site), stamps, part.year, part.month, part.day,
+                            part.hour, part.minute, part.utc_offset, column))
+                written += len(part)
+        return written
+
+    def load(self, path, quarantine=None):
+        #Upserts every reading of a CSV export
+        return self.upsert(iter_data(path, BATCH_SIZE, quarantine))
+
+    def sites(self):
+        return [site for (site,) in self.connection.execute(
+            'SELECT DISTINCT site FROM readings ORDER BY site')]
+
+    def _where(self, start, end, sites=()):
+        #Date range as row-value comparisons, which SQLite answers from the
+        #(year, month, day) index, and the sites asked for
+        clauses, params = [], []
+        for value, op in ((to_date(start), '>='), (to_date(end), '<=')):
+            if value is not None:
+                clauses.append(f'(year, month, day) {op} (?, ?, ?)')
+                params.extend((value.year, value.month, value.day))
+        if sites:
+            clauses.append(f'site IN ({", ".join("?" * len(sites))})')
+            params.extend(sites)
+        return (' WHERE ' + ' AND '.join(clauses) if clauses else ''), params
+
+    def table(self, start=None, end=None, sites=None):
+        #The stored readings from start to end (inclusive, either may be None)
+        #as an EnergyTable at their own interval, keeping only timestamps every
+        #site has a reading for
+        sites = list(sites or self.sites())
+        where, params = self._where(start, end, sites)
+        pivot = ', '.join('SUM(CASE WHEN site = ? THEN kwh END)' for site in sites)
+        query = (f'SELECT year, month, day, hour, minute, utc_offset, {pivot} FROM readings{where}'
+                 f' GROUP BY ts HAVING COUNT(DISTINCT site) = ? ORDER BY ts')
+        return self._read(query, sites + params + [len(sites)], sites)
+
+    def daily(self, start=None, end=None, sites=None):
+        #One row per local day with each site's total for it, summed in SQL;
+        #days missing a site are left out, as the CSV loader leaves out rows
+        sites = list(sites or self.sites())
+        where, params = self._where(start, end, sites)
+        pivot = ', '.join('SUM(CASE WHEN site = ? THEN kwh END)' for site in sites)
+        query = (f'SELECT year, month, day, 0, 0, utc_offset, {pivot}, MIN(ts) FROM readings{where}'
+                 f' GROUP BY year, month, day HAVING COUNT(DISTINCT site) = ? ORDER BY year, month, day')
+        return self._read(query, sites + params + [len(sites)], sites, drop=1)
+
+    def _read(self, query, params, sites, drop=0):
+        rows = self.connection.execute(query, params).fetchall()
+        table = EnergyTable(sites)
+        if rows:
+            columns = list(zip(*rows))
+            if drop:
+                del columns[-drop:]
+            for name, column in zip(EnergyTable.DATE_COLUMNS, columns):
+                setattr(table, name, array(getattr(table, name).typecode, column))
+            for site, column in zip(sites, columns[len(EnergyTable.DATE_COLUMNS):]):
+                table.readings[site] = array('d', column)
+            table.interval = guess_interval(table.hour, table.minute)
+        return table
+
+    def summarize(self, start=None, end=None, sites=None):
+        #EnergySummary of the stored days, for any report in Analysis.py or
+        #CostSavings.py. Time-of-day profiles for the tariff engine are grouped
+        #in SQL from the stored intervals.
+        from summary import EnergySummary, PROFILE_HOURS, PROFILE_SIZE
+        sites = list(sites or self.sites())
+        where, params = self._where(start, end, sites)
+        daily = self.daily(start, end, sites)
+        intervals = self.connection.execute(
+            f'SELECT COUNT(*) FROM readings{where}{" AND" if where else " WHERE"} (hour OR minute)',
+            params).fetchone()[0]
+        if not intervals:
+            return EnergySummary().update(daily)
+        #strftime('%w') is 0 on Sunday and 6 on Saturday
+        weekend = "strftime('%w', printf('%04d-%02d-%02d', year, month, day)) IN ('0', '6')"
+        query = (f'SELECT year, month, site, {weekend} AS weekend, hour, SUM(kwh) FROM readings{where}'
+                 f' GROUP BY year, month, site, weekend, hour')
+        months = EnergySummary().update(daily).months
+        for group in months.values():
+            for stats in [group, *group.sites.values()]:
+                stats.profile = array('d', bytes(8 * PROFILE_SIZE))
+        for year, month, site, weekend, hour, kwh in self.connection.execute(query, params):
+            group = months.get((year, month))
+            if group is not None and site in group.sites:
+                group.profile[weekend * PROFILE_HOURS + hour] += kwh
+                group.sites[site].profile[weekend * PROFILE_HOURS + hour] += kwh
+        return EnergySummary.from_months(months)
+
+    @property
+    def summary(self):
+        #Lets summarize() and every report take the store itself
+        return self.summarize()
+
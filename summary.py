@@ -0,0 +1,391 @@
+#Single-pass aggregation shared by every report in Analysis.py and CostSavings.py.
+#One scan over the data fills per-month accumulators; seasonal, yearly and
+#overall numbers are then merged from those months instead of being
+#recomputed from the raw rows by each report.
+from array import array
+from datetime import date
+from bisect import bisect_left, bisect_right
+from itertools import chain, repeat
+from math import fsum
+from operator import add, ge, le, methodcaller, mul
+
+from builddata import DAY, SEASONS, Energy, iter_batches
+from profiling import profiled
+from resample import resample
+from sketch import QuantileSketch
+
+MONTH_NAMES = ['January', 'February', 'March', 'April', 'May','June',
+               'July', 'August', 'September','October', 'November', 'December']
+
+
+class RunningTotal:
+    #A float total kept as a rounded value plus its rounding error, so adding
+    #batches or merging totals gives the same answer as one fsum over all values.
+    __slots__ = ('value', 'error')
+
+    def __init__(self):
+        self.value = 0.0
+        self.error = 0.0
+
+    def add(self, values):
+        parts = (self.value, self.error)
+        total = fsum(chain(parts, values))
+        self.error = fsum(chain(parts, values, (-total,)))
+        self.value = total
+
+    def merge(self, other):
+        self.add((other.value, other.error))
+
+    def to_list(self):
+        return [self.value, self.error]
+
+    @classmethod
+    def from_list(cls, parts):
+        total = cls()
+        total.value, total.error = parts
+        return total
+
+
+#Energy by time of day, for pricing against time-of-use tariffs: slot
+#weekend * PROFILE_HOURS + hour, where hour is WHOLE_DAY for daily rows that
+#have no time of day
+WHOLE_DAY = 24
+PROFILE_HOURS = 25
+PROFILE_SIZE = 2 * PROFILE_HOURS
+
+
+def profile_buckets(table):
+    #Profile slot of every row of an EnergyTable
+    n = len(table)
+    weekend = map(ge, map(methodcaller('weekday'), map(date, table.year, table.month, table.day)), repeat(5, n))
+    hours = table.hour if table.interval < DAY else repeat(WHOLE_DAY, n)
+    return array('B', map(add, map(mul, weekend, repeat(PROFILE_HOURS, n)), hours))
+
+
+def profile_runs(buckets, start, stop):
+    #Rows [start, stop) sorted by profile slot, and (slot, lo, hi) for the run
+    #of each slot in that order, so every column can be split with slices
+    order = sorted(range(start, stop), key=buckets.__getitem__)
+    keys = array('B', map(buckets.__getitem__, order))
+    runs = [(key, bisect_left(keys, key), bisect_right(keys, key)) for key in set(keys)]
+    return order, runs
+
+
+class Stats:
+    #Sum, count, min/max and the days they happened on, for one series of daily
+    #values. max_day and min_day are (year, month, day) tuples; profile splits
+    #the total by weekday/weekend and hour (see profile_buckets), and sketch
+    #holds the distribution of the daily values for quantiles.
+    __slots__ = ('total', 'days', 'max', 'min', 'max_day', 'min_day', 'profile', 'sketch')
+
+    def __init__(self):
+        self.total = RunningTotal()
+        self.days = 0
+        self.max = None
+        self.min = None
+        self.max_day = None
+        self.min_day = None
+        self.profile = array('d', bytes(8 * PROFILE_SIZE))
+        self.sketch = QuantileSketch()
+
+    def add_column(self, table, column, start, stop):
+        #Folds rows [start, stop) of one table column of daily rows into the stats
+        values = column[start:stop]
+        self.total.add(values)
+        self.sketch.add(values)
+        self.days += stop - start
+        rows = range(start, stop)
+        highest = max(rows, key=column.__getitem__)
+        lowest = min(rows, key=column.__getitem__)
+        if self.max is None or column[highest] > self.max:
+            self._set_max(table, highest, column[highest])
+        if self.min is None or column[lowest] < self.min:
+            self._set_min(table, lowest, column[lowest])
+
+    def add_profile(self, column, slots):
+        #Adds one column's rows to the profile; slots comes from profile_runs
+        order, runs = slots
+        ordered = list(map(column.__getitem__, order))
+        for key, lo, hi in runs:
+            self.profile[key] += fsum(ordered[lo:hi])
+
+    def _set_max(self, table, row, value):
+        self.max = value
+        self.max_day = table.date_of(row)
+
+    def _set_min(self, table, row, value):
+        self.min = value
+        self.min_day = table.date_of(row)
+
+    def merge(self, other):
+        #Combines two stats; on ties the one merged first keeps its day
+        self.total.merge(other.total)
+        self.days += other.days
+        self.profile = array('d', map(add, self.profile, other.profile))
+        self.sketch.merge(other.sketch)
+        if other.max is not None and (self.max is None or other.max > self.max):
+            self.max = other.max
+            self.max_day = other.max_day
+        if other.min is not None and (self.min is None or other.min < self.min):
+            self.min = other.min
+            self.min_day = other.min_day
+        return self
+
+    def to_dict(self):
+        #Plain JSON-ready form, for saving running state between runs
+        return {
+            'total': self.total.to_list(),
+            'days': self.days,
+            'max': self.max,
+            'min': self.min,
+            'max_day': self.max_day,
+            'min_day': self.min_day,
+            'profile': self.profile.tolist(),
+            'sketch': self.sketch.to_dict(),
+        }
+
+    @classmethod
+    def from_dict(cls, state):
+        stats = cls()
+        stats.total = RunningTotal.from_list(state['total'])
+        stats.days = state['days']
+        stats.max = state['max']
+        stats.min = state['min']
+        stats.max_day = tuple(state['max_day']) if state['max_day'] else None
+        stats.min_day = tuple(state['min_day']) if state['min_day'] else None
+        stats.profile = array('d', state['profile'])
+        stats.sketch = QuantileSketch.from_dict(state['sketch'])
+        return stats
+
+
+class GroupStats(Stats):
+    #Accumulator for one calendar group: Stats of the combined daily totals, the
+    #full rows of the days they peaked and bottomed out, and Stats for each site
+    __slots__ = ('max_row', 'min_row', 'sites')
+
+    def __init__(self):
+        super().__init__()
+        self.max_row = None
+        self.min_row = None
+        self.sites = {}
+
+    def add_rows(self, table, totals, start, stop):
+        #Folds rows [start, stop) of a daily EnergyTable into the group
+        self.add_column(table, totals, start, stop)
+        for site, column in table.readings.items():
+            self.site(site).add_column(table, column, start, stop)
+
+    def add_profile(self, table, totals, buckets, start, stop):
+        #Adds rows [start, stop) of a table at any interval to the profiles
+        slots = profile_runs(buckets, start, stop)
+        super().add_profile(totals, slots)
+        for site, column in table.readings.items():
+            self.site(site).add_profile(column, slots)
+
+    def _set_max(self, table, row, value):
+        super()._set_max(table, row, value)
+        self.max_row = table[row]
+
+    def _set_min(self, table, row, value):
+        super()._set_min(table, row, value)
+        self.min_row = table[row]
+
+    def site(self, name):
+        stats = self.sites.get(name)
+        if stats is None:
+            stats = self.sites[name] = Stats()
+        return stats
+
+    def merge(self, other):
+        if other.max is not None and (self.max is None or other.max > self.max):
+            self.max_row = other.max_row
+        if other.min is not None and (self.min is None or other.min < self.min):
+            self.min_row = other.min_row
+        super().merge(other)
+        for name, stats in other.sites.items():
+            self.site(name).merge(stats)
+        return self
+
+    def to_dict(self):
+        state = super().to_dict()
+        state['max_row'] = _row_to_list(self.max_row)
+        state['min_row'] = _row_to_list(self.min_row)
+        state['sites'] = {name: stats.to_dict() for name, stats in self.sites.items()}
+        return state
+
+    @classmethod
+    def from_dict(cls, state):
+        group = super().from_dict(state)
+        group.max_row = _row_from_list(state['max_row'])
+        group.min_row = _row_from_list(state['min_row'])
+        group.sites = {name: Stats.from_dict(stats) for name, stats in state['sites'].items()}
+        return group
+
+
+def _row_to_list(row):
+    if row is None:
+        return None
+    return [row.year, row.month, row.day, row.readings, row.hour, row.minute, row.utc_offset]
+
+
+def _row_from_list(state):
+    if state is None:
+        return None
+    return Energy.from_readings(*state)
+
+
+def _in_month_order(table):
+    #Shuffled rows would make a run per row; a stable sort by month makes one
+    #run per month and keeps the rows of each month in their original order
+    keys = array('l', map(add, map(mul, table.year, repeat(12, len(table))), table.month))
+    if all(map(le, keys, keys[1:])):
+        return table
+    return table.take(sorted(range(len(table)), key=keys.__getitem__))
+
+
+def last_day_start(table):
+    #Row where the table's final day begins
+    cut = len(table)
+    last = table.date_of(cut - 1) if cut else None
+    while cut and table.date_of(cut - 1) == last:
+        cut -= 1
+    return cut
+
+
+def season_of(month):
+    for season, months in SEASONS.items():
+        if month in months:
+            return season
+
+
+class EnergySummary:
+    #Rollup of daily rows up the calendar: GroupStats per (year, month), per
+    #season (all years together, as seasonal_analysis reports them) and per year.
+    #Months are filled from the rows; seasons and years are rebuilt from their
+    #months, and only for the months an update touched, so folding in new days
+    #costs time for those days plus a few merges.
+    LEVELS = ('month', 'season', 'year')
+
+    def __init__(self):
+        self.months = {}
+        self.seasons = {}
+        self.years = {}
+
+    def update(self, data):
+        #Takes an EnergyTable, a list of Energy, or any iterator of records or
+        #batches; iterators are consumed once, one batch at a time. Interval
+        #rows (15 minute, hourly) fill the time-of-day profiles as they are and
+        #are resampled to days for everything else. The rows of a day that runs
+        #on into the next batch are held back and summed with the rest of it;
+        #a day split across two update() calls is counted as two.
+        touched = set()
+        held = None
+        for table in iter_batches(data):
+            if table.interval < DAY:
+                if held:
+                    joined = held[:]
+                    joined.extend(table)
+                    table = joined
+                cut = last_day_start(table)
+                held = table[cut:]
+                table = table[:cut]
+            self._add(table, touched)
+        if held:
+            self._add(held, touched)
+        self._roll_up(touched)
+        return self
+
+    def _add(self, table, touched):
+        if table.interval > DAY:
+            raise ValueError('rows longer than a day cannot be summarized by day')
+        table = _in_month_order(table)
+        totals = table.totals()
+        buckets = profile_buckets(table)
+        for key, start, stop in table.month_runs():
+            self._group(key).add_profile(table, totals, buckets, start, stop)
+        if table.interval < DAY:
+            table = resample(table, 'day')
+            totals = table.totals()
+        for key, start, stop in table.month_runs():
+            self._group(key).add_rows(table, totals, start, stop)
+            touched.add(key)
+
+    def _group(self, key):
+        group = self.months.get(key)
+        if group is None:
+            group = self.months[key] = GroupStats()
+        return group
+
+    def merge(self, other):
+        #Folds another summary in, as if its rows had been passed to update()
+        for key, group in other.months.items():
+            self.months.setdefault(key, GroupStats()).merge(group)
+        self._roll_up(other.months)
+        return self
+
+    def to_dict(self):
+        return {'months': [[year, month, group.to_dict()]
+                           for (year, month), group in sorted(self.months.items())]}
+
+    @classmethod
+    def from_dict(cls, state):
+        return cls.from_months({(year, month): GroupStats.from_dict(group)
+                                for year, month, group in state['months']})
+
+    @classmethod
+    def from_months(cls, months):
+        #Summary over ready-made month groups, keyed by (year, month)
+        summary = cls()
+        summary.months = dict(months)
+        summary._roll_up(summary.months)
+        return summary
+
+    def _roll_up(self, month_keys):
+        for season in {season_of(month) for year, month in month_keys}:
+            self.seasons[season] = self.combine(key for key in self.months if season_of(key[1]) == season)
+        for year in {year for year, month in month_keys}:
+            self.years[year] = self.combine(key for key in self.months if key[0] == year)
+
+    def level(self, name):
+        #GroupStats for every group at one level: 'month', 'season' or 'year'
+        return {'month': self.months, 'season': self.seasons, 'year': self.years}[name]
+
+    @property
+    def days(self):
+        return sum(group.days for group in self.years.values())
+
+    @property
+    def sites(self):
+        #Every site seen, in the order they first appear
+        names = {}
+        for key in sorted(self.months):
+            names.update(dict.fromkeys(self.months[key].sites))
+        return list(names)
+
+    def combine(self, keys):
+        #Merges the month groups for the given keys in calendar order
+        result = GroupStats()
+        for key in sorted(keys):
+            result.merge(self.months[key])
+        return result
+
+    def overall(self):
+        result = GroupStats()
+        for year in sorted(self.years):
+            result.merge(self.years[year])
+        return result
+
+    def season(self, name):
+        return self.seasons.get(name)
+
+
+@profiled()
+def summarize(data):
+    #Returns a summary for raw data, or the summary itself if one is passed in,
+    #so callers can scan once and hand the result to any number of reports.
+    #An EnergyTable keeps its own summary up to date as rows are added.
+    if isinstance(data, EnergySummary):
+        return data
+    if hasattr(data, 'summary'):
+        return data.summary
+    return EnergySummary().update(data)
@@ -0,0 +1,104 @@
+#Time-of-use tariffs. A TouTariff turns a schedule of seasonal peak and
+#off-peak windows into one flat array of rates indexed by month, weekday or
+#weekend, and hour, so pricing is array lookups and map(mul) rather than an
+#if/else per reading.
+#
+#    cost = E_TOU_C.cost(summary)                  # from the summary's profiles
+#    rates = E_TOU_C.row_rates(table)              # one rate per interval row
+#
+#Daily exports have no time of day; those rows are priced at the average rate
+#over DAYLIGHT, the hours a solar array is actually producing.
+from array import array
+from itertools import repeat
+from math import fsum
+from operator import add, mul, sub
+
+from profiling import profiled
+from summary import PROFILE_HOURS, PROFILE_SIZE, WHOLE_DAY, profile_buckets, summarize
+
+ALL_DAYS = 'all'
+WEEKDAYS = 'weekdays'
+WEEKENDS = 'weekends'
+DAYLIGHT = range(7, 19)
+
+
+class TouTariff:
+    #schedule is a list of (months, hours, rate) or (months, hours, rate, days)
+    #periods, with days one of ALL_DAYS, WEEKDAYS or WEEKENDS. Later periods
+    #override earlier ones, so a base rate for every hour can be given first and
+    #the peak windows laid over it. Hours nothing covers cost 0.
+
+    def __init__(self, name, schedule, daily_hours=DAYLIGHT):
+        self.name = name
+        #rates[(month - 1) * PROFILE_SIZE + slot] for the profile slots of summary.py
+        self.rates = array('d', bytes(8 * 12 * PROFILE_SIZE))
+        for period in schedule:
+            months, hours, rate = period[:3]
+            days = period[3] if len(period) > 3 else ALL_DAYS
+            weekends = {ALL_DAYS: (0, 1), WEEKDAYS: (0,), WEEKENDS: (1,)}[days]
+            for month in months:
+                for weekend in weekends:
+                    for hour in hours:
+                        self.rates[self._slot(month, weekend, hour)] = rate
+        daily_hours = list(daily_hours)
+        for month in range(1, 13):
+            for weekend in (0, 1):
+                self.rates[self._slot(month, weekend, WHOLE_DAY)] = fsum(
+                    self.rate(month, hour, weekend) for hour in daily_hours) / len(daily_hours)
+
+    def __repr__(self):
+        return f'TouTariff({self.name!r})'
+
+    @staticmethod
+    def _slot(month, weekend, hour):
+        return (month - 1) * PROFILE_SIZE + weekend * PROFILE_HOURS + hour
+
+    def rate(self, month, hour, weekend=False):
+        return self.rates[self._slot(month, int(weekend), hour)]
+
+    def month_rates(self, month):
+        #The rates lined up with a Stats.profile for that month
+        start = (month - 1) * PROFILE_SIZE
+        return self.rates[start:start + PROFILE_SIZE]
+
+    def row_rates(self, table):
+        #Rate for every row of an EnergyTable, found with one lookup per row
+        n = len(table)
+        slots = map(add, map(mul, map(sub, table.month, repeat(1, n)), repeat(PROFILE_SIZE, n)),
+                    profile_buckets(table))
+        return array('d', map(self.rates.__getitem__, slots))
+
+    @profiled('tariff_table_cost', arg=1)
+    def table_cost(self, table, site=None):
+        #Cost of a table's rows priced interval by interval, for one site or all
+        rates = self.row_rates(table)
+        columns = [table.readings[site]] if site else table.readings.values()
+        return fsum(fsum(map(mul, column, rates)) for column in columns)
+
+    def group_cost(self, month, stats):
+        #Cost of one month's Stats (or GroupStats) from its time-of-day profile
+        return fsum(map(mul, stats.profile, self.month_rates(month)))
+
+    @profiled('tariff_cost', arg=1)
+    def cost(self, data):
+        #Total cost of all the energy in data; takes raw data or an EnergySummary
+        summary = summarize(data)
+        return fsum(self.group_cost(month, group) for (year, month), group in summary.months.items())
+
+
+#PG&E residential time-of-use (E-TOU-C): peak 4-9pm every day, summer June to
+#September. Rates are approximate 2024 figures; check the current tariff book
+#before quoting them.
+SUMMER_MONTHS = [6, 7, 8, 9]
+WINTER_MONTHS = [1, 2, 3, 4, 5, 10, 11, 12]
+PEAK_HOURS = range(16, 21)
+
+E_TOU_C = TouTariff('PG&E E-TOU-C', [
+    (SUMMER_MONTHS, range(24), 0.43),
+    (WINTER_MONTHS, range(24), 0.36),
+    (SUMMER_MONTHS, PEAK_HOURS, 0.49),
+    (WINTER_MONTHS, PEAK_HOURS, 0.39),
+])
+
+#Tariffs by the names the command line and report server take
+TARIFFS = {'e-tou-c': E_TOU_C}
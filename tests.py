@@ -1,4 +1,6 @@
 from builddata import *
+import json
+import os
 import unittest
 import main
 import Analysis
@@ -23,7 +25,11 @@ class TestCostSavings(unittest.TestCase):
         input = get_data()
         expected = {'2024-July': {'total_production': 1088755.875, 'avg_daily_production': 35121.157258064515, 'days_recorded': 31, 'max_day': 39114.875, 'min_day': 26000.625}}
         result = Analysis.monthly_analysis(input)
-        self.assertEqual(expected, result)
+        # Every month of the export, not just the first
+        self.assertEqual(len(result), 17)
+        self.assertEqual(list(result)[-1], '2025-November')
+        self.assertEqual(sum(month['days_recorded'] for month in result.values()), 494)
+        self.assertEqual(expected['2024-July'], result['2024-July'])
 
 
     #Tests total savings is calculated correctly with default rate
@@ -46,7 +52,7 @@ class TestCostSavings(unittest.TestCase):
         self.assertAlmostEqual(result['total_kwh_produced'], expected_kwh, places=2)
 
 
-class TestCostSavings(unittest.TestCase):
+class TestCostSavingsRealData(unittest.TestCase):
     """All tests use real Cal Poly data"""
 
     def setUp(self):
@@ -59,4 +65,946 @@ class TestCostSavings(unittest.TestCase):
 
     def test_yearly_projection(self):
         result = yearly_savings_projection(self.data, rate_per_kwh=0.30)
-        self.assertGreater(result['projected_annual_savings'], 3_000_000)
\ No newline at end of file
+        self.assertGreater(result['projected_annual_savings'], 3_000_000)
+
+class TestEnergyTable(unittest.TestCase):
+
+    def test_rows_match_columns(self):
+        table = get_data()
+        rows = list(table)
+        self.assertEqual(len(rows), len(table))
+        self.assertEqual(rows[0], Energy(2024, 7, 1, 35500.0, 2835.125))
+        self.assertEqual(table[-1], rows[-1])
+        self.assertEqual(list(table[10:20]), rows[10:20])
+
+    def test_list_and_table_agree(self):
+        table = get_data()
+        rows = list(table)
+        self.assertEqual(Analysis.production_analysis(rows), Analysis.production_analysis(table))
+        self.assertEqual(Analysis.monthly_analysis(rows), Analysis.monthly_analysis(table))
+        self.assertEqual(monthly_savings_breakdown(rows), monthly_savings_breakdown(table))
+
+
+class TestSummary(unittest.TestCase):
+
+    def test_one_summary_feeds_every_report(self):
+        from summary import summarize
+        from CostSavings import comprehensive_cost_analysis
+        data = get_data()
+        summary = summarize(data)
+        self.assertEqual(summary.days, len(data))
+        self.assertEqual(Analysis.production_analysis(summary), Analysis.production_analysis(data))
+        self.assertEqual(Analysis.seasonal_analysis(summary), Analysis.seasonal_analysis(data))
+        self.assertEqual(comprehensive_cost_analysis(summary), comprehensive_cost_analysis(data))
+
+    def test_merged_halves_match_whole(self):
+        from summary import summarize
+        data = get_data()
+        whole = summarize(data).overall()
+        merged = summarize(data[:250]).overall().merge(summarize(data[250:]).overall())
+        self.assertEqual(merged.total.value, whole.total.value)
+        self.assertEqual(merged.max_row, whole.max_row)
+        self.assertEqual(merged.days, whole.days)
+
+
+class TestStreaming(unittest.TestCase):
+
+    def test_reports_accept_iterators(self):
+        from CostSavings import comprehensive_cost_analysis
+        expected = Analysis.production_analysis(get_data())
+        self.assertEqual(Analysis.production_analysis(iter_data(DATA_FILE)), expected)
+        self.assertEqual(Analysis.production_analysis(iter_data(DATA_FILE, batch_size=50)), expected)
+        self.assertEqual(comprehensive_cost_analysis(iter_data(DATA_FILE, batch_size=7)),
+                         comprehensive_cost_analysis(get_data()))
+
+    def test_iter_data_reads_file_objects(self):
+        import io
+        text = ('Timestamp,Cal Poly Gold Tree Solar (C) Total Meter Energy,'
+                'Cal Poly Student Housing Solar Total Meter Energy,,\n'
+                '2024-07-01 00:00:00 PDT,35500.0kWh,2835.1kWh,35500,2835.125\n'
+                '2024-07-02 00:00:00 PDT,35000.0kWh,2795.9kWh,35000,2795.875\n')
+        records = list(iter_data(io.StringIO(text)))
+        self.assertEqual(records, [Energy(2024, 7, 1, 35500.0, 2835.125),
+                                   Energy(2024, 7, 2, 35000.0, 2795.875)])
+
+
+class TestDataCache(unittest.TestCase):
+
+    def setUp(self):
+        import shutil
+        import tempfile
+        self.folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.folder)
+        self.path = os.path.join(self.folder, 'export.csv')
+        shutil.copyfile(DATA_FILE, self.path)
+
+    def test_warm_load_matches_parse(self):
+        import datacache
+        self.assertIsNone(datacache.load(self.path))
+        cold = get_data(self.path)
+        warm = datacache.load(self.path)
+        self.assertIsNotNone(warm)
+        self.assertEqual(list(warm), list(cold))
+        self.assertEqual(list(get_data(self.path, cache=False)), list(cold))
+
+    def test_changed_csv_is_reparsed(self):
+        import datacache
+        get_data(self.path)
+        with open(self.path, 'a') as f:
+            f.write('2025-11-15 00:00:00 PST,100.0kWh,10.0kWh,100,10\n')
+        self.assertIsNone(datacache.load(self.path))
+        self.assertEqual(get_data(self.path)[-1], Energy(2025, 11, 15, 100.0, 10.0))
+
+    def test_touched_csv_still_hits_cache(self):
+        import datacache
+        get_data(self.path)
+        stat = os.stat(self.path)
+        os.utime(self.path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+        self.assertIsNotNone(datacache.load(self.path))
+
+
+class TestSiteSchema(unittest.TestCase):
+    EXPORT = ('Timestamp,North Roof Total Meter Energy,South Roof Total Meter Energy,Carport Total Meter Energy\n'
+              '2024-07-01 00:00:00 PDT,100.0kWh,200.0kWh,50.0kWh\n'
+              '2024-07-02 00:00:00 PDT,110.0kWh,190.0kWh,60.0kWh\n'
+              '2024-08-01 00:00:00 PDT,120.0kWh,0.0kWh,70.0kWh\n'
+              '2024-12-01 00:00:00 PST,90.0kWh,150.0kWh,40.0kWh\n')
+
+    def test_sites_come_from_header(self):
+        import io
+        schema, lines = split_header(io.StringIO(self.EXPORT))
+        self.assertEqual(schema.sites, ('north_roof', 'south_roof', 'carport'))
+        self.assertEqual(read_schema(DATA_FILE).sites, ('goldtree', 'housing'))
+        records = list(iter_data(io.StringIO(self.EXPORT)))
+        self.assertEqual(len(records), 3)
+        self.assertEqual(records[0], Energy(2024, 7, 1, north_roof=100.0, south_roof=200.0, carport=50.0))
+
+    def test_per_site_reports(self):
+        import io
+        from CostSavings import total_cost_savings
+        table = as_table(iter_data(io.StringIO(self.EXPORT)))
+        production = Analysis.production_analysis(table)
+        self.assertEqual(production['total_production_kwh'], 990.0)
+        self.assertEqual(production['total_carport_kwh'], 150.0)
+        seasons = Analysis.seasonal_analysis(table, by_site=True)
+        self.assertEqual(seasons['Summer']['sites']['south_roof']['max_production'], 200.0)
+        self.assertEqual(seasons['Winter']['sites']['north_roof']['days'], 1)
+        savings = total_cost_savings(table, 0.5, by_site=True)
+        self.assertEqual(savings['sites']['north_roof']['total_savings'], 150.0)
+
+
+class TestDateIndex(unittest.TestCase):
+
+    def test_windows_match_filters(self):
+        table = get_data()
+        window = table.window('2024-10-01', '2025-03-31')
+        expected = [row for row in table if (2024, 10) <= (row.year, row.month) <= (2025, 3)]
+        self.assertEqual(list(window), expected)
+        self.assertEqual(len(table.window(end='2024-07-31')), 31)
+        self.assertEqual(Analysis.monthly_analysis(table.month_window(2024, 7)),
+                         {'2024-July': Analysis.monthly_analysis(table)['2024-July']})
+
+    def test_season_window_across_years(self):
+        table = get_data()
+        winter = table.season_window('Winter')
+        self.assertEqual(Analysis.production_analysis(winter)['total_production_kwh'],
+                         Analysis.seasonal_analysis(table)['Winter']['total_production'])
+        self.assertTrue(all(row.year == 2025 for row in table.season_window('Summer', years=[2025])))
+
+    def test_unsorted_rows(self):
+        table = get_data()
+        shuffled = table.take(reversed(range(len(table))))
+        self.assertEqual(list(shuffled.window('2025-01-01', '2025-01-31')),
+                         list(table.window('2025-01-01', '2025-01-31')))
+
+
+class TestRollup(unittest.TestCase):
+
+    def test_levels_agree(self):
+        from summary import summarize
+        table = get_data()
+        summary = summarize(table)
+        self.assertIs(summary, summarize(table))
+        years = summary.level('year')
+        self.assertEqual(sorted(years), [2024, 2025])
+        self.assertEqual(sum(group.days for group in years.values()), len(table))
+        self.assertEqual(sum(group.days for group in summary.level('season').values()), len(table))
+        housing = summary.overall().sites['housing']
+        self.assertEqual(housing.max_day, (2024, 10, 23))
+        self.assertEqual(housing.max, 420060.25)
+
+    def test_appended_days_update_rollup(self):
+        table = get_data(cache=False)
+        before = Analysis.production_analysis(table)
+        table.append(2025, 12, 1, 1000.0, 500.0)
+        after = Analysis.production_analysis(table)
+        self.assertEqual(after['days_analyzed'], before['days_analyzed'] + 1)
+        self.assertAlmostEqual(after['total_production_kwh'], before['total_production_kwh'] + 1500.0)
+        self.assertEqual(table.summary.level('month')[(2025, 12)].days, 1)
+        self.assertEqual(Analysis.seasonal_analysis(table)['Winter']['days'], 88)
+
+
+class TestIncremental(unittest.TestCase):
+
+    def setUp(self):
+        import shutil
+        import tempfile
+        self.folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.folder)
+        self.path = os.path.join(self.folder, 'export.csv')
+        with open(DATA_FILE) as f:
+            self.lines = f.readlines()
+
+    def write(self, lines, mode='w'):
+        with open(self.path, mode) as f:
+            f.writelines(lines)
+
+    def test_only_new_rows_are_parsed(self):
+        from incremental import IncrementalSummary
+        from CostSavings import comprehensive_cost_analysis
+        self.write(self.lines[:300])
+        first = IncrementalSummary(self.path).refresh().days
+        self.write(self.lines[300:], 'a')
+        feed = IncrementalSummary(self.path)
+        summary = feed.refresh()
+        self.assertEqual(feed.rows_added, 494 - first)
+        self.assertEqual(Analysis.production_analysis(summary), Analysis.production_analysis(get_data()))
+        self.assertEqual(comprehensive_cost_analysis(summary), comprehensive_cost_analysis(get_data()))
+        feed.refresh()
+        self.assertEqual(feed.rows_added, 0)
+
+    def test_partial_line_waits(self):
+        from incremental import IncrementalSummary
+        self.write(self.lines[:10] + [self.lines[10][:12]])
+        feed = IncrementalSummary(self.path)
+        self.assertEqual(feed.refresh().days, 9)
+        self.write([self.lines[10][12:]], 'a')
+        self.assertEqual(feed.refresh().days, 10)
+
+    def test_rewritten_file_is_rebuilt(self):
+        from incremental import IncrementalSummary
+        self.write(self.lines[:100])
+        IncrementalSummary(self.path).refresh()
+        self.write(self.lines[:50])
+        self.assertEqual(IncrementalSummary(self.path).refresh().days, 49)
+
+    def test_unfinished_day_is_read_again(self):
+        import io
+        from incremental import IncrementalSummary
+        #15 minute readings for 2024-11-02 to 04, appended part way through the 3rd
+        lines = TestIntervals.export().splitlines(keepends=True)
+        self.write(lines[:150])
+        feed = IncrementalSummary(self.path)
+        self.assertEqual(feed.refresh().days, 1)
+        self.write(lines[150:], 'a')
+        summary = IncrementalSummary(self.path).refresh()
+        whole = as_table(iter_data(io.StringIO(''.join(lines))))
+        self.assertEqual(summary.days, 3)
+        self.assertEqual(Analysis.production_analysis(summary), Analysis.production_analysis(whole))
+
+
+class TestMultiFileIngest(unittest.TestCase):
+
+    def setUp(self):
+        import shutil
+        import tempfile
+        self.folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.folder)
+        with open(DATA_FILE) as f:
+            header, *lines = f.readlines()
+        #Split mid-month so a month is shared between files
+        for number, part in enumerate((lines[:100], lines[100:350], lines[350:])):
+            with open(os.path.join(self.folder, f'part{number}.csv'), 'w') as f:
+                f.writelines([header] + part)
+
+    def test_parallel_matches_single_file(self):
+        from ingest import find_files, summarize_files
+        from CostSavings import comprehensive_cost_analysis
+        self.assertEqual(len(find_files(self.folder)), 3)
+        self.assertEqual(len(find_files(os.path.join(self.folder, 'part[01].csv'))), 2)
+        summary = summarize_files(self.folder, processes=2)
+        data = get_data()
+        self.assertEqual(Analysis.production_analysis(summary), Analysis.production_analysis(data))
+        self.assertEqual(Analysis.seasonal_analysis(summary), Analysis.seasonal_analysis(data))
+        self.assertEqual(Analysis.monthly_analysis(summary), Analysis.monthly_analysis(data))
+        self.assertEqual(comprehensive_cost_analysis(summary), comprehensive_cost_analysis(data))
+        serial = summarize_files(self.folder, processes=1)
+        self.assertEqual(Analysis.production_analysis(serial), Analysis.production_analysis(data))
+
+    def test_one_export_per_site(self):
+        from ingest import summarize_files
+        from CostSavings import comprehensive_cost_analysis
+        from tariff import E_TOU_C
+
+        def split(text, folder):
+            #One export per site, each with its own display and number column
+            header, *lines = text.splitlines()
+            names = header.split(',')[1:3]
+            for n, name in enumerate(names):
+                with open(os.path.join(folder, f'site{n}.csv'), 'w') as f:
+                    f.write(f'Timestamp,{name},\n')
+                    for line in lines:
+                        cells = line.split(',')
+                        f.write(f'{cells[0]},{cells[1 + n]},{cells[3 + n]}\n')
+
+        with open(DATA_FILE) as f:
+            split(f.read(), self.folder)
+        paths = [os.path.join(self.folder, f'site{n}.csv') for n in range(2)]
+        data = get_data()
+        for processes in (1, 2):
+            summary = summarize_files(paths, processes)
+            self.assertEqual(summary.days, data.summary.days)
+            self.assertEqual(Analysis.production_analysis(summary), Analysis.production_analysis(data))
+            self.assertEqual(Analysis.seasonal_analysis(summary, percentiles=True),
+                             Analysis.seasonal_analysis(data, percentiles=True))
+            self.assertEqual(comprehensive_cost_analysis(summary), comprehensive_cost_analysis(data))
+        #Interval exports keep their time-of-day profiles for tariffs
+        import io
+        text = TestIntervals.export()
+        split(text, self.folder)
+        table = as_table(iter_data(io.StringIO(text)))
+        summary = summarize_files(paths, processes=1)
+        self.assertEqual(Analysis.monthly_analysis(summary), Analysis.monthly_analysis(table))
+        self.assertAlmostEqual(E_TOU_C.cost(summary), E_TOU_C.cost(table))
+        #A day one site's export lacks is left out of the profiles too
+        with open(paths[1]) as f:
+            lines = [line for line in f if not line.startswith('2024-11-03')]
+        with open(paths[1], 'w') as f:
+            f.writelines(lines)
+        rest = table.take(row for row in range(len(table)) if table.day[row] != 3)
+        for processes in (1, 2):
+            summary = summarize_files(paths, processes)
+            self.assertEqual(summary.days, 2)
+            self.assertEqual(Analysis.monthly_analysis(summary), Analysis.monthly_analysis(rest))
+            self.assertAlmostEqual(E_TOU_C.cost(summary), E_TOU_C.cost(rest))
+
+    def test_compressed_exports(self):
+        import bz2
+        import gzip
+        import lzma
+        import zipfile
+        from ingest import find_files, summarize_files
+        with open(DATA_FILE, 'rb') as f:
+            raw = f.read()
+        data = get_data()
+        #Compression is recognised from the content, not the name
+        for name, compress in (('a.csv.gz', gzip.compress), ('b.csv.bz2', bz2.compress), ('c.export', lzma.compress)):
+            path = os.path.join(self.folder, name)
+            with open(path, 'wb') as f:
+                f.write(compress(raw))
+            self.assertEqual(Analysis.production_analysis(get_data(path, cache=False)), Analysis.production_analysis(data))
+        for name in ('part0.csv', 'part1.csv'):
+            os.rename(os.path.join(self.folder, name), os.path.join(self.folder, name + '.gz'))
+            with open(os.path.join(self.folder, name + '.gz'), 'rb') as f:
+                part = f.read()
+            with open(os.path.join(self.folder, name + '.gz'), 'wb') as f:
+                f.write(gzip.compress(part))
+        archive = os.path.join(self.folder, 'parts.zip')
+        with zipfile.ZipFile(archive, 'w', zipfile.ZIP_DEFLATED) as z:
+            for name in ('part0.csv.gz', 'part1.csv.gz', 'part2.csv'):
+                with open(os.path.join(self.folder, name), 'rb') as f:
+                    z.writestr(name.removesuffix('.gz'), gzip.decompress(f.read()) if name.endswith('.gz') else f.read())
+        files = [os.path.join(self.folder, name) for name in ('part0.csv.gz', 'part1.csv.gz', 'part2.csv')]
+        self.assertEqual([os.path.basename(path) if isinstance(path, str) else path[1] for path in find_files(self.folder)],
+                         ['a.csv.gz', 'b.csv.bz2', 'part0.csv.gz', 'part1.csv.gz', 'part2.csv',
+                          'part0.csv', 'part1.csv', 'part2.csv'])
+        self.assertEqual(len(find_files(archive)), 3)
+        #A directory holding only the archive
+        zipped = os.path.join(self.folder, 'zipped')
+        os.mkdir(zipped)
+        os.rename(archive, os.path.join(zipped, 'parts.zip'))
+        for source in (files, zipped):
+            summary = summarize_files(source, processes=2)
+            self.assertEqual(Analysis.monthly_analysis(summary), Analysis.monthly_analysis(data))
+
+
+class TestQuarantine(unittest.TestCase):
+
+    def test_sample_rejections(self):
+        quarantine = Quarantine()
+        data = get_data(quarantine=quarantine)
+        self.assertEqual(len(data), 494)
+        self.assertEqual(quarantine.counts, {'unreadable reading': 1, 'zero reading': 4, 'blank line': 1})
+        self.assertEqual(quarantine.rows[0][:2], (148, 'unreadable reading'))
+        self.assertEqual([row[0] for row in quarantine.rows if row[1] == 'zero reading'], [231, 232, 233, 359])
+
+    def test_bad_rows_among_good_ones(self):
+        import io
+        header = 'Timestamp,Cal Poly Gold Tree Solar (C) Total Meter Energy,Cal Poly Student Housing Solar Total Meter Energy,,\n'
+        good = [f'2024-08-{day:02d} 00:00:00 PDT,1.0kWh,2.0kWh,{day}.5,2.25\n' for day in range(1, 29)]
+        bad = ['2024-08-29 00:00:00 PDT,1.0kWh,2.0kWh,29.5\n',
+               'not a date,1.0kWh,2.0kWh,3,4\n',
+               '2024-13-01 00:00:00 PST,1.0kWh,2.0kWh,3,4\n',
+               '2024-08-30 00:00:00 PDT,1.0kWh,2.0kWh,3,nan\n',
+               '2024-02-30 00:00:00 PST,1.0kWh,2.0kWh,3,4\n',
+               '0000-07-01 00:00:00 PDT,1.0kWh,2.0kWh,3,4\n',
+               '-024-07-01 00:00:00 PDT,1.0kWh,2.0kWh,3,4\n']
+        text = header + ''.join(good[:10] + bad + good[10:])
+        quarantine = Quarantine()
+        table = as_table(iter_data(io.StringIO(text), quarantine=quarantine))
+        self.assertEqual(list(table), list(iter_data(io.StringIO(header + ''.join(good)))))
+        self.assertEqual([row[:2] for row in quarantine.rows],
+                         [(12, 'wrong column count'), (13, 'bad timestamp'),
+                          (14, 'bad timestamp'), (15, 'non-finite reading'),
+                          (16, 'bad timestamp'), (17, 'bad timestamp'), (18, 'bad timestamp')])
+
+    def test_bulk_and_row_paths_agree(self):
+        with open(DATA_FILE) as f:
+            header, *lines = f.readlines()
+        schema = split_header([header])[0]
+        clean = ''.join(lines[:140])
+        self.assertIsNotNone(parse_block(clean, schema))
+        self.assertEqual(list(parse_block(clean, schema)),
+                         list(EnergyTable.from_rows(schema.sites, list(parse_lines(lines[:140], schema)))))
+
+
+class TestIntervals(unittest.TestCase):
+
+    @staticmethod
+    def export():
+        # 15 minute readings from 2024-11-02 to 2024-11-04 local time, across
+        # the end of daylight saving time; each reading is 1 + its hour
+        from datetime import datetime, timedelta
+        header = 'Timestamp,Cal Poly Gold Tree Solar (C) Total Meter Energy,Cal Poly Student Housing Solar Total Meter Energy,,\n'
+        lines = []
+        moment = datetime(2024, 11, 2, 7)
+        while moment < datetime(2024, 11, 5, 8):
+            offset = -7 if moment < datetime(2024, 11, 3, 9) else -8
+            local = moment + timedelta(hours=offset)
+            zone = 'PDT' if offset == -7 else 'PST'
+            lines.append(f'{local:%Y-%m-%d %H:%M:%S} {zone},x,x,{local.hour + 1},0.5\n')
+            moment += timedelta(minutes=15)
+        return header + ''.join(lines)
+
+    def test_full_timestamps(self):
+        import io
+        table = as_table(iter_data(io.StringIO(self.export())))
+        self.assertEqual(table.interval, 900)
+        self.assertEqual(len(table), 3 * 96 + 4)
+        self.assertEqual(set(table.utc_offset), {-420, -480})
+        stamps = table.timestamps()
+        self.assertEqual(set(b - a for a, b in zip(stamps, stamps[1:])), {900})
+        self.assertEqual(table[0].minute, 0)
+        self.assertEqual((table[1].hour, table[1].minute), (0, 15))
+
+    def test_resample(self):
+        import io
+        from resample import resample
+        table = as_table(iter_data(io.StringIO(self.export())))
+        hourly = resample(table, 'hour')
+        self.assertEqual(hourly.interval, 3600)
+        # 1am happens twice on 2024-11-03, once in PDT and once in PST
+        repeated = [row for row in hourly if row.day == 3 and row.hour == 1]
+        self.assertEqual([row.utc_offset for row in repeated], [-420, -480])
+        self.assertEqual([row.goldtree for row in repeated], [8.0, 8.0])
+        daily = resample(table, 'day')
+        self.assertEqual([(row.day, row.housing) for row in daily], [(2, 48.0), (3, 50.0), (4, 48.0)])
+        self.assertEqual(resample(table, 'month')[0].goldtree, sum(table.goldtree))
+        self.assertIs(resample(daily, 'day'), daily)
+
+    def test_reports_at_any_resolution(self):
+        import io
+        from resample import resample
+        table = as_table(iter_data(io.StringIO(self.export())))
+        daily = resample(table, 'day')
+        expected = Analysis.production_analysis(daily)
+        self.assertEqual(expected['days_analyzed'], 3)
+        self.assertEqual(Analysis.production_analysis(table), expected)
+        self.assertEqual(Analysis.production_analysis(resample(table, 'hour')), expected)
+        # Batches that cut days in two still give whole days
+        streamed = iter_data(io.StringIO(self.export()), batch_size=50)
+        self.assertEqual(Analysis.production_analysis(streamed), expected)
+        self.assertEqual(Analysis.monthly_analysis(table), Analysis.monthly_analysis(daily))
+
+
+class TestAnomalies(unittest.TestCase):
+
+    def test_rolling_matches_direct_computation(self):
+        import io
+        from datetime import date, timedelta
+        from statistics import mean, stdev
+        from anomaly import rolling
+        table = get_data()
+        batches = list(rolling(table))
+        self.assertEqual(len(batches), 1)
+        result = batches[0]
+        self.assertEqual(result['dates'][40], table.date_of(40))
+        # Windows are days, not rows: the export skips days, so a window can
+        # hold fewer readings than its size
+        days = [date(*table.date_of(row)) for row in range(len(table))]
+        short = 0
+        for row in range(len(table)):
+            for size in (7, 30):
+                values = [value for day, value in zip(days, table.housing)
+                          if days[row] - timedelta(size) < day <= days[row]]
+                short += len(values) < size and row >= size
+                self.assertAlmostEqual(result['housing'][size]['mean'][row], mean(values), places=6)
+                if len(values) > 1:
+                    self.assertAlmostEqual(result['housing'][size]['std'][row], stdev(values), places=6)
+        self.assertGreater(short, 0)
+        streamed = list(rolling(iter_data(batch_size=50)))
+        self.assertEqual(len(streamed), 10)
+        self.assertEqual([mean for batch in streamed for mean in batch['goldtree'][30]['mean']],
+                         list(result['goldtree'][30]['mean']))
+        with self.assertRaises(ValueError):
+            next(rolling(as_table(iter_data(io.StringIO(TestIntervals.export())))))
+
+    def test_glitches_are_flagged_or_excluded(self):
+        from anomaly import Anomalies, clean, screen
+        anomalies = Anomalies()
+        self.assertEqual(sum(map(len, screen(get_data(), anomalies))), 494)
+        found = {(day, site) for day, site, value, expected in anomalies.rows}
+        self.assertIn(((2024, 10, 23), 'housing'), found)
+        self.assertIn(((2024, 10, 24), 'goldtree'), found)
+        # Ordinary cloudy days are left alone
+        self.assertNotIn(((2024, 9, 15), 'goldtree'), found)
+        excluded = clean(get_data())
+        self.assertEqual(len(excluded), 494 - len({day for day, site in found}))
+        result = Analysis.production_analysis(excluded)
+        self.assertLess(result['highest_day_kwh'].housing, 10_000)
+        self.assertGreater(result['lowest_day_kwh'].goldtree, 1_000)
+        streamed = Analysis.production_analysis(screen(iter_data(batch_size=64), exclude=True))
+        self.assertEqual(streamed, result)
+
+
+class TestQuantileSketch(unittest.TestCase):
+
+    def test_quantiles_within_accuracy(self):
+        import random
+        from sketch import QuantileSketch
+        rng = random.Random(7)
+        values = [rng.lognormvariate(10, 1) for i in range(20_000)]
+        sketch = QuantileSketch()
+        sketch.add(values)
+        ordered = sorted(values)
+        for q in (0.05, 0.5, 0.95):
+            exact = ordered[int(q * (len(values) - 1))]
+            self.assertLess(abs(sketch.quantile(q) - exact) / exact, 0.011)
+        # Merging halves gives exactly the sketch of the whole
+        halves = QuantileSketch(), QuantileSketch()
+        halves[0].add(values[:7000])
+        halves[1].add(values[7000:])
+        self.assertEqual(halves[1].merge(halves[0]).to_dict(), sketch.to_dict())
+        self.assertLess(len(json.dumps(sketch.to_dict())), 8000)
+
+    def test_percentile_reports(self):
+        import statistics
+        table = get_data()
+        seasons = Analysis.seasonal_analysis(table, by_site=True, percentiles=True)
+        summer = [row.total for row in table.season_window('Summer')]
+        exact = statistics.median_low(summer)
+        self.assertLess(abs(seasons['Summer']['p50_production'] - exact) / exact, 0.011)
+        self.assertIn('p95_production', seasons['Summer']['sites']['housing'])
+        months = Analysis.monthly_analysis(table, percentiles=True)
+        self.assertLessEqual(months['2024-July']['p5_day'], months['2024-July']['p95_day'])
+        # Sketches survive saving and merging like the rest of the summary
+        from summary import EnergySummary
+        from ingest import merge_summaries
+        halves = [EnergySummary().update(table[:250]), EnergySummary().update(table[250:])]
+        merged = merge_summaries(EnergySummary.from_dict(json.loads(json.dumps(half.to_dict()))) for half in halves)
+        self.assertEqual(Analysis.seasonal_analysis(merged, percentiles=True),
+                         Analysis.seasonal_analysis(table, percentiles=True))
+
+
+class TestStore(unittest.TestCase):
+
+    def setUp(self):
+        import tempfile
+        self.folder = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.folder.name, 'energy.db')
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def test_reports_from_the_store(self):
+        from store import EnergyStore
+        from CostSavings import monthly_savings_breakdown
+        table = get_data()
+        with EnergyStore(self.path) as store:
+            self.assertEqual(store.upsert(table[:300]), 300)
+            # The second export overlaps the first by 100 days
+            store.upsert(table[200:])
+            self.assertEqual(len(store), 2 * 494)
+        with EnergyStore(self.path) as store:
+            self.assertEqual(Analysis.seasonal_analysis(store), Analysis.seasonal_analysis(table))
+            self.assertEqual(Analysis.monthly_analysis(store), Analysis.monthly_analysis(table))
+            self.assertEqual(monthly_savings_breakdown(store), monthly_savings_breakdown(table))
+            july = store.summarize('2024-07-01', '2024-07-31')
+            self.assertEqual(Analysis.monthly_analysis(july), {'2024-July': Analysis.monthly_analysis(table)['2024-July']})
+            self.assertEqual(list(store.table('2024-07-01', '2024-07-31')), list(table.month_window(2024, 7)))
+
+    def test_upsert_replaces_readings(self):
+        from store import EnergyStore
+        store = EnergyStore()
+        store.upsert([Energy(2024, 7, 1, 10.0, 1.0), Energy(2024, 7, 2, 20.0, 2.0)])
+        store.upsert([Energy(2024, 7, 2, 25.0, 3.0)])
+        self.assertEqual(list(store.table()), [Energy(2024, 7, 1, 10.0, 1.0), Energy(2024, 7, 2, 25.0, 3.0)])
+
+    def test_interval_readings_are_summed_in_sql(self):
+        import io
+        from store import EnergyStore
+        from tariff import E_TOU_C
+        table = as_table(iter_data(io.StringIO(TestIntervals.export())))
+        store = EnergyStore()
+        store.upsert(table)
+        self.assertEqual(store.table().interval, 900)
+        self.assertEqual(len(store.daily()), 3)
+        self.assertEqual(Analysis.production_analysis(store), Analysis.production_analysis(table))
+        self.assertAlmostEqual(E_TOU_C.cost(store), E_TOU_C.cost(table))
+
+    def test_some_of_the_sites(self):
+        from store import EnergyStore
+        table = get_data()
+        rows = [(row.year, row.month, row.day, 0, 0, 0, row.goldtree, row.housing, row.goldtree + row.housing)
+                for row in table]
+        store = EnergyStore()
+        store.upsert(EnergyTable.from_rows(('a', 'b', 'c'), rows))
+        two = EnergyTable.from_rows(('a', 'b'), [row[:8] for row in rows])
+        self.assertEqual(len(store.table(sites=['a', 'b'])), 494)
+        self.assertEqual(list(store.daily(sites=['a'])), list(EnergyTable.from_rows(('a',), [row[:7] for row in rows])))
+        self.assertEqual(Analysis.production_analysis(store.summarize(sites=['a', 'b'])),
+                         Analysis.production_analysis(two))
+
+
+class TestMergeExports(unittest.TestCase):
+
+    def test_overlapping_exports_count_once(self):
+        from dedup import MergeReport, merge_exports
+        table = get_data()
+        first, second = table[:300], table[250:]
+        report = MergeReport()
+        merged = merge_exports([first, second], report=report)
+        self.assertEqual(list(merged), list(table))
+        self.assertEqual(report.rows, 544)
+        self.assertEqual(report.duplicates, 50)
+        self.assertEqual(report.replaced, 0)
+        self.assertEqual(total_cost_savings(merged), total_cost_savings(table))
+
+    def test_conflict_policies(self):
+        from dedup import MergeReport, merge_exports
+        old = EnergyTable.from_records([Energy(2024, 7, 1, 10.0, 1.0), Energy(2024, 7, 2, 20.0, 2.0)])
+        new = EnergyTable.from_records([Energy(2024, 7, 2, 15.0, 2.0), Energy(2024, 7, 3, 30.0, 3.0)])
+        report = MergeReport()
+        latest = merge_exports([old, new], 'latest', report)
+        self.assertEqual(latest[1], Energy(2024, 7, 2, 15.0, 2.0))
+        # One row overlaps; its housing reading matches but goldtree changed
+        self.assertEqual((report.replaced, report.duplicates), (1, 0))
+        report = MergeReport()
+        self.assertEqual(merge_exports([old, new], 'max', report)[1], Energy(2024, 7, 2, 20.0, 2.0))
+        self.assertEqual((report.replaced, report.duplicates), (0, 0))
+        report = MergeReport()
+        merge_exports([old, old, new], 'latest', report)
+        self.assertEqual((report.rows, report.replaced, report.duplicates), (6, 1, 2))
+        report = MergeReport()
+        flagged = merge_exports([old, new], 'flag', report)
+        self.assertEqual(flagged[1], Energy(2024, 7, 2, 20.0, 2.0))
+        self.assertEqual(report.conflicts, [('goldtree', old.timestamps()[1], 20.0, 15.0, 1)])
+        self.assertEqual(len(set(flagged) | set(latest)), 4)
+        with self.assertRaises(ValueError):
+            merge_exports([old], 'newest')
+
+
+class TestBenchmark(unittest.TestCase):
+
+    def setUp(self):
+        import tempfile
+        self.folder = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def test_generated_exports(self):
+        from benchmark import generate_csv
+        path = os.path.join(self.folder.name, 'a.csv')
+        bad = generate_csv(path, 2000, sites=3, bad_rows=0.02, seed=5)
+        quarantine = Quarantine()
+        table = get_data(path, cache=False, quarantine=quarantine)
+        self.assertEqual(len(table), 2000)
+        self.assertEqual(len(quarantine), bad)
+        self.assertGreater(bad, 0)
+        self.assertEqual(table.sites, ('goldtree', 'housing', 'site_3'))
+        again = os.path.join(self.folder.name, 'b.csv')
+        generate_csv(again, 2000, sites=3, bad_rows=0.02, seed=5)
+        with open(path) as f, open(again) as g:
+            self.assertEqual(f.read(), g.read())
+        generate_csv(path, 96 * 3, resolution='15min')
+        self.assertEqual(get_data(path, cache=False).interval, 900)
+
+    def test_run_benchmark(self):
+        from benchmark import compare, run_benchmark
+        run = run_benchmark(500, repeat=1, folder=self.folder.name)
+        self.assertIn('comprehensive_cost_analysis', run['stages'])
+        self.assertGreater(run['stages']['get_data']['peak_bytes'], 0)
+        report = json.loads(json.dumps({'runs': [run]}))
+        self.assertEqual(len(compare(report, report)), len(run['stages']))
+
+    def test_run_benchmark_on_part_of_a_year(self):
+        # 1000 hourly rows are about six weeks, too few months to simulate
+        from benchmark import compare, run_benchmark
+        run = run_benchmark(1000, resolution='hour', repeat=1, memory=False, folder=self.folder.name)
+        self.assertTrue(run['stages']['simulated_projection']['skipped'])
+        self.assertGreater(run['stages']['rate_scenarios']['seconds'], 0)
+        report = {'runs': [run]}
+        self.assertEqual(len(compare(report, report)), len(run['stages']) - 1)
+
+
+class TestProfiling(unittest.TestCase):
+
+    def setUp(self):
+        import profiling
+        from reportcache import CACHE
+        self.profiling = profiling
+        profiling.reset()
+        CACHE.clear()
+
+    def tearDown(self):
+        self.profiling.disable()
+        self.profiling.reset()
+
+    def test_off_by_default(self):
+        Analysis.production_analysis(get_data())
+        with self.profiling.stage('nothing'):
+            pass
+        self.assertEqual(self.profiling.records, [])
+
+    def test_stages(self):
+        from CostSavings import comprehensive_cost_analysis
+        profiling = self.profiling
+        profiling.enable()
+        data = get_data()
+        with profiling.stage('reports', rows=len(data)):
+            Analysis.seasonal_analysis(data)
+            comprehensive_cost_analysis(data)
+        stages = {total['stage']: total for total in profiling.summary()}
+        self.assertEqual(stages['get_data']['rows'], len(data))
+        self.assertEqual(stages['seasonal_analysis']['rows'], len(data))
+        self.assertEqual(stages['comprehensive_cost_analysis']['calls'], 1)
+        self.assertGreaterEqual(stages['total_cost_savings']['calls'], 1)
+        #The enclosing stage takes at least as long as, and peaks at least as
+        #high as, what ran inside it
+        self.assertGreaterEqual(stages['reports']['seconds'], stages['seasonal_analysis']['seconds'])
+        self.assertGreaterEqual(stages['reports']['peak_bytes'], stages['comprehensive_cost_analysis']['peak_bytes'])
+        self.assertGreater(stages['reports']['rows_per_second'], 0)
+        self.assertEqual(json.loads(profiling.to_json())['stages'], json.loads(json.dumps(profiling.summary())))
+        self.assertIn('seasonal_analysis', profiling.summary_table())
+
+class TestReportCache(unittest.TestCase):
+
+    def setUp(self):
+        from reportcache import CACHE
+        self.cache = CACHE
+        CACHE.clear()
+
+    def test_hits_and_invalidation(self):
+        data = get_data()
+        first = Analysis.seasonal_analysis(data)
+        self.assertEqual(self.cache.stats()['misses'], 1)
+        #Another load of the same export, with the defaults spelled out
+        again = Analysis.seasonal_analysis(get_data(), by_site=False)
+        self.assertEqual(again, first)
+        self.assertEqual(self.cache.stats()['hits'], 1)
+        #Changing a result doesn't change the cached one
+        again.clear()
+        self.assertEqual(Analysis.seasonal_analysis(data), first)
+        data.append(2030, 6, 1, *[1000.0] * len(data.sites))
+        self.assertNotEqual(Analysis.seasonal_analysis(data), first)
+        self.assertEqual(self.cache.stats()['misses'], 2)
+        self.assertEqual(total_cost_savings(data, 0.25), total_cost_savings(data, rate_per_kwh=0.25))
+        self.assertNotEqual(total_cost_savings(data, 0.25), total_cost_savings(data, 0.30))
+
+    def test_lru(self):
+        from reportcache import ReportCache, memoized
+        cache = ReportCache(maxsize=2)
+        calls = []
+
+        @memoized(cache=cache)
+        def report(data, rate=1.0):
+            calls.append(rate)
+            return {'total': len(data) * rate}
+
+        data = get_data()
+        for rate in (1.0, 2.0, 1.0, 3.0, 2.0):
+            self.assertEqual(report(data, rate), {'total': len(data) * rate})
+        self.assertEqual(calls, [1.0, 2.0, 3.0, 2.0])
+        self.assertEqual(cache.stats()['evictions'], 2)
+        self.assertEqual(len(cache), 2)
+        #Only tables are fingerprinted; anything else is passed straight through
+        report(list(data))
+        report(list(data))
+        self.assertEqual(len(calls), 6)
+
+class TestCommandLine(unittest.TestCase):
+
+    def run_main(self, *argv):
+        import contextlib
+        import io
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            code = main.main(list(argv))
+        return code, out.getvalue()
+
+    def test_import_does_no_work(self):
+        import subprocess
+        import sys
+        check = subprocess.run([sys.executable, '-c', 'import sys, main; print(sorted(set(sys.modules) & '
+                                '{"builddata", "Analysis", "CostSavings", "argparse", "json"}))'],
+                               capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+        self.assertEqual(check.stdout.strip(), '[]')
+
+    def test_tariff_choices(self):
+        # main.TARIFFS stands in for tariff.TARIFFS so the parser doesn't
+        # import the tariff engine; the two must name the same tariffs
+        import tariff
+        self.assertEqual(set(main.TARIFFS), set(tariff.TARIFFS))
+
+    def test_reports(self):
+        code, out = self.run_main('production', '--format', 'json')
+        self.assertEqual(code, 0)
+        self.assertEqual(json.loads(out)['days_analyzed'], Analysis.production_analysis(get_data())['days_analyzed'])
+        code, out = self.run_main('monthly', '--start', '2025-03-01', '--end', '2025-03-31', '--format', 'csv')
+        self.assertEqual(out.splitlines()[0], 'key,value')
+        self.assertIn('2025-March.total_production', out)
+        self.assertNotIn('2025-April', out)
+        code, out = self.run_main('costs', '--rate', '0.25')
+        self.assertIn('total_savings.rate_used: 0.25', out)
+        code, out = self.run_main('seasonal', '--start', '2040-01-01')
+        self.assertEqual((code, out), (1, ''))
+
+class TestLiveFeed(unittest.TestCase):
+
+    def setUp(self):
+        import tempfile
+        from benchmark import generate_csv
+        self.folder = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.folder.name, 'live.csv')
+        generate_csv(self.path, 24 * 1000, resolution='hour')
+        with open(self.path) as f:
+            self.header, *self.lines = f.readlines()
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def test_many_feeds(self):
+        import asyncio
+        from livefeed import LiveIngest, stand_in_feed
+        feeds = 1000
+
+        async def run():
+            gate = asyncio.Event()
+            #Every connection gets the header and a day of its own
+            server = await stand_in_feed(lambda n: [self.header] + self.lines[24 * n:24 * n + 24], gate=gate)
+            port = server.sockets[0].getsockname()[1]
+            async with LiveIngest(queue_size=16) as ingest:
+                tasks = [ingest.follow('127.0.0.1', port) for n in range(feeds)]
+                while ingest.open_feeds < feeds:
+                    await asyncio.sleep(0.01)
+                gate.set()
+                await asyncio.gather(*tasks)
+            server.close()
+            return ingest
+
+        ingest = asyncio.run(run())
+        self.assertEqual(ingest.peak_feeds, feeds)
+        self.assertEqual(ingest.rows, len(self.lines))
+        self.assertEqual(Analysis.production_analysis(ingest.summary),
+                         Analysis.production_analysis(get_data(self.path, cache=False)))
+
+    def test_push_and_http(self):
+        import asyncio
+        from livefeed import LiveIngest, stand_in_feed
+        days = self.lines[:24 * 3]
+
+        async def run():
+            async with LiveIngest(batch_size=10, queue_size=1) as ingest:
+                server = await ingest.serve()
+                port = server.sockets[0].getsockname()[1]
+                #Two gateways pushing the first two days between them
+                for pushed, part in enumerate((days[:30], days[30:48]), 1):
+                    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+                    writer.write(''.join([self.header] + part).encode())
+                    await writer.drain()
+                    writer.close()
+                    while ingest.connections < pushed or ingest.open_feeds:
+                        await asyncio.sleep(0.01)
+                feed = await stand_in_feed([self.header] + days[48:], http=True)
+                await ingest.follow('127.0.0.1', feed.sockets[0].getsockname()[1], '/feed')
+                await ingest.drain()
+                #The third day might not be over yet
+                held = Analysis.production_analysis(ingest.summary)
+                current = Analysis.production_analysis(ingest.snapshot())
+                feed.close()
+            return held, current, ingest
+
+        held, current, ingest = asyncio.run(run())
+        self.assertEqual(held['days_analyzed'], 2)
+        self.assertEqual(current['days_analyzed'], 3)
+        self.assertEqual(Analysis.production_analysis(ingest.summary), current)
+
+    def test_quarantine_line_numbers(self):
+        import asyncio
+        from livefeed import LiveIngest
+        lines = [self.header] + self.lines[:48]
+        for row in (20, 40):
+            lines[row] = lines[row][:lines[row].rindex(',')] + ',n/a\n'
+        text = ''.join(lines).encode()
+
+        async def chunks():
+            #Small reads, so the bad rows arrive in different chunks
+            for start in range(0, len(text), 100):
+                yield text[start:start + 100]
+
+        async def run(quarantine):
+            async with LiveIngest(quarantine=quarantine) as ingest:
+                await ingest.feed(None, chunks())
+
+        quarantine = Quarantine()
+        asyncio.run(run(quarantine))
+        with open(self.path, 'w') as f:
+            f.writelines(lines)
+        expected = Quarantine()
+        get_data(self.path, cache=False, quarantine=expected)
+        self.assertEqual([row[:2] for row in quarantine.rows], [(21, 'unreadable reading'), (41, 'unreadable reading')])
+        self.assertEqual(quarantine.rows, expected.rows)
+
+
+class TestReportServer(unittest.TestCase):
+
+    def setUp(self):
+        from server import Reports
+        self.data = get_data()
+        self.reports = Reports(get_data())
+
+    def test_responses(self):
+        from CostSavings import comprehensive_cost_analysis
+        status, body = self.reports.respond('/seasonal')
+        self.assertEqual(status, 200)
+        self.assertEqual(json.loads(body), json.loads(json.dumps(Analysis.seasonal_analysis(self.data), default=str)))
+        status, body = self.reports.respond('/costs?rate=0.25&pge_rate=0.35')
+        self.assertEqual(json.loads(body), json.loads(json.dumps(comprehensive_cost_analysis(self.data, 0.25, 0.35))))
+        #The same view again comes from the response cache
+        self.assertEqual(self.reports.respond('/costs?pge_rate=0.35&rate=0.25'), (status, body))
+        self.assertEqual(self.reports.cache.stats()['hits'], 1)
+        status, body = self.reports.respond('/monthly?start=2025-03-01&end=2025-03-31&by_site=yes')
+        self.assertEqual(list(json.loads(body)), ['2025-March'])
+        self.assertEqual(self.reports.respond('/monthly?start=2040-01-01')[0], 404)
+        self.assertEqual(self.reports.respond('/nothing')[0], 404)
+        for bad in ('/costs?rate=cheap', '/costs?tariff=flat', '/production?rate=0.3', '/monthly?start=March',
+                    '/seasonal?by_site=maybe', '/costs?rate=0.2&rate=0.3'):
+            status, body = self.reports.respond(bad)
+            self.assertEqual(status, 400, bad)
+            self.assertIn('error', json.loads(body))
+
+    def test_load(self):
+        import threading
+        from loadtest import run_load
+        from server import ReportServer
+        server = ReportServer(('127.0.0.1', 0), self.reports, threads=4)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        try:
+            result = run_load('127.0.0.1', server.server_address[1], clients=50, requests=4)
+        finally:
+            server.shutdown()
+            server.server_close()
+        self.assertEqual((result['completed'], result['errors']), (200, 0))
+        self.assertLessEqual(result['p50_ms'], result['p99_ms'])